@@ -1,45 +1,101 @@
-import json
-from pathlib import Path
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from collections import defaultdict, Counter
+from collections import Counter
+from playlist_corpus import load_corpus, make_song_id
+from figures import figure_html
+
+# Songs each model contributes to the comparison chart, and the most
+# rows it can have; the rest are summed into OTHER_SONGS
+COMPARISON_TOP_SONGS = 10
+COMPARISON_MAX_SONGS = 40
+OTHER_SONGS = "Other songs"
+
+# Songs per page of the comparison drill-down
+COMPARISON_PAGE_SIZE = 50
 
 
 def load_playlist_data():
-    outputs_dir = Path("outputs")
-    all_playlists = []
-
-    for model_dir in outputs_dir.iterdir():
-        if model_dir.is_dir() and not model_dir.name == "error_logs":
-            model_name = model_dir.name.replace("_", "/")
-            for playlist_file in model_dir.glob("playlist_*.json"):
-                try:
-                    with open(playlist_file) as f:
-                        playlist_data = json.load(f)
-                        # Add model information to each song
-                        if "songs" in playlist_data:
-                            for song in playlist_data["songs"]:
-                                song["model"] = model_name
-                                all_playlists.append(song)
-                except Exception as e:
-                    print(f"Error loading {playlist_file}: {e}")
-
-    return pd.DataFrame(all_playlists)
+    # Categorical columns from the Parquet corpus, so groupbys work on
+    # integer codes instead of hashing strings
+    return load_corpus()
 
 
 def get_song_frequencies(df):
     # Combine song and artist to create unique identifier
-    df["song_id"] = df["song"] + " - " + df["artist"]
-    return df["song_id"].value_counts()
+    if "song_id" not in df.columns:
+        df["song_id"] = make_song_id(df)
+    counts = df["song_id"].value_counts()
+    return counts[counts > 0]
+
 
+def get_model_top_songs(df, summary=None):
+    summary = summary or summarize_models(df)
+    return {model: Counter(stats["song_counts"]) for model, stats in summary.items()}
 
-def get_model_top_songs(df):
-    model_songs = defaultdict(Counter)
-    for _, row in df.iterrows():
-        song_id = f"{row['song']} - {row['artist']}"
-        model_songs[row["model"]][song_id] += 1
-    return model_songs
+
+def get_model_song_counts(df):
+    """How often each model picked each song, in one grouped count.
+
+    Returns a frame with model, song_id, song, artist and count, sorted by
+    count within each model; models keep their order in df.
+    """
+    if "song_id" not in df.columns:
+        df["song_id"] = make_song_id(df)
+    counts = (
+        df.groupby(["model", "song_id", "song", "artist"], observed=True, sort=False)
+        .size()
+        .reset_index(name="count")
+    )
+    model_order = pd.factorize(counts["model"])[0]
+    counts = counts.assign(_order=model_order).sort_values(
+        ["_order", "count"], ascending=[True, False], kind="stable"
+    )
+    return counts.drop(columns="_order").reset_index(drop=True)
+
+
+def summarize_models(df, top_songs=10, top_artists=5, song_counts=None):
+    """Per-model song statistics from a single pass over df.
+
+    Returns {model: {"unique_songs", "total_songs", "diversity_ratio",
+    "song_counts", "top_songs", "top_artists"}}. song_counts maps every
+    song_id the model picked to its count; top songs are dicts with song,
+    artist and count, top artists dicts with artist, count and song, the
+    artist's most picked song. song_counts is get_model_song_counts(df),
+    computed here if not given.
+    """
+    if song_counts is None:
+        song_counts = get_model_song_counts(df)
+    artist_counts = (
+        song_counts.groupby(["model", "artist"], observed=True, sort=False)
+        .agg(count=("count", "sum"), song=("song", "first"))
+        .reset_index()
+        .sort_values("count", ascending=False, kind="stable")
+    )
+    artists_by_model = dict(list(artist_counts.groupby("model", observed=True)))
+
+    summary = {}
+    for model, model_counts in song_counts.groupby("model", observed=True, sort=False):
+        unique_songs = len(model_counts)
+        total_songs = int(model_counts["count"].sum())
+        summary[model] = {
+            "unique_songs": unique_songs,
+            "total_songs": total_songs,
+            "diversity_ratio": (
+                round(unique_songs / total_songs, 2) if total_songs > 0 else 0
+            ),
+            "song_counts": dict(
+                zip(model_counts["song_id"], model_counts["count"].tolist())
+            ),
+            "top_songs": model_counts.head(top_songs)[["song", "artist", "count"]]
+            .astype({"song": str, "artist": str})
+            .to_dict("records"),
+            "top_artists": artists_by_model[model]
+            .head(top_artists)[["artist", "count", "song"]]
+            .astype({"song": str, "artist": str})
+            .to_dict("records"),
+        }
+    return summary
 
 
 def create_song_frequency_plot(song_frequencies):
@@ -68,45 +124,119 @@ def create_song_frequency_plot(song_frequencies):
         margin=dict(l=20, r=20, t=40, b=20),  # Adjust margins
     )
 
-    return fig.to_html(full_html=False)
+    return figure_html(fig)
 
 
-def create_model_comparison_plot(df):
-    """Create a scatter plot comparing model song selections."""
-    model_song_counts = (
-        df.groupby(["model", "song_id"]).size().reset_index(name="count")
+def get_model_comparison_table(df, song_counts=None):
+    """Every song's pick count per model, most picked song first.
+
+    Returns {"models": [...], "rows": [[song_id, total, count per model]]},
+    the data behind the comparison chart's paginated drill-down.
+    """
+    if song_counts is None:
+        song_counts = get_model_song_counts(df)
+    models = [str(model) for model in pd.unique(song_counts["model"])]
+    table = (
+        song_counts.astype({"model": str, "song_id": str})
+        .groupby(["song_id", "model"])["count"]
+        .sum()
+        .unstack(fill_value=0)
+        .reindex(columns=models, fill_value=0)
     )
+    table.insert(0, "total", table.sum(axis=1))
+    table = table.sort_values("total", ascending=False, kind="stable")
+    rows = [
+        [song_id, *counts]
+        for song_id, counts in zip(table.index, table.values.tolist())
+    ]
+    return {"models": models, "rows": rows}
+
+
+def get_model_comparison_page(table, page, page_size=COMPARISON_PAGE_SIZE):
+    """One page (numbered from 1) of get_model_comparison_table's rows."""
+    pages = max(1, -(-len(table["rows"]) // page_size))
+    start = (page - 1) * page_size
+    return {
+        "page": page,
+        "pages": pages,
+        "models": table["models"],
+        "rows": table["rows"][start : start + page_size],
+    }
 
-    fig = px.scatter(
-        model_song_counts,
-        x="model",
-        y="song_id",
-        size="count",
-        title="Song Selection Patterns by Model",
-        template="plotly_dark",  # Use dark theme
-        color_discrete_sequence=["#1DB954"],  # Spotify green
-        hover_data=["count"],  # Show count in hover tooltip
+
+def create_model_comparison_plot(df, top_k=COMPARISON_TOP_SONGS, song_counts=None):
+    """Create a scatter plot comparing model song selections.
+
+    Only each model's top_k songs get a row of their own, at most
+    COMPARISON_MAX_SONGS in all; every model's other picks are summed into
+    an "Other songs" row, so the figure's size does not grow with the
+    corpus. Points are drawn with WebGL.
+    """
+    if song_counts is None:
+        song_counts = get_model_song_counts(df)
+    song_counts = song_counts.astype({"model": str, "song_id": str})
+
+    # Songs in any model's top_k, most picked overall first
+    top = song_counts.groupby("model", sort=False).head(top_k)
+    totals = song_counts.groupby("song_id")["count"].sum()
+    shown = (
+        totals[totals.index.isin(top["song_id"])]
+        .sort_values(ascending=False, kind="stable")
+        .head(COMPARISON_MAX_SONGS)
+        .index
+    )
+
+    is_shown = song_counts["song_id"].isin(shown)
+    points = song_counts.loc[is_shown, ["model", "song_id", "count"]].assign(songs=1)
+    other = (
+        song_counts[~is_shown]
+        .groupby("model", sort=False)
+        .agg(count=("count", "sum"), songs=("song_id", "size"))
+        .reset_index()
+        .assign(song_id=OTHER_SONGS)
+    )
+    points = pd.concat([points, other], ignore_index=True)
+    rows = list(shown) + ([OTHER_SONGS] if len(other) else [])
+
+    fig = go.Figure(
+        go.Scattergl(
+            x=points["model"],
+            y=points["song_id"],
+            mode="markers",
+            marker=dict(
+                size=points["count"],
+                sizemode="area",
+                sizeref=2.0 * max(points["count"].max(), 1) / 40**2,
+                sizemin=3,
+                color="#1DB954",  # Spotify green
+                line=dict(width=1, color="#191414"),  # Dark border around points
+                opacity=0.7,  # Slight transparency
+            ),
+            customdata=points[["count", "songs"]],
+            hovertemplate=(
+                "%{x}<br>%{y}<br>count=%{customdata[0]}"
+                " (%{customdata[1]} songs)<extra></extra>"
+            ),
+        )
     )
 
     fig.update_layout(
-        height=1000,  # Taller to accommodate all songs
+        title="Song Selection Patterns by Model",
+        template="plotly_dark",  # Use dark theme
+        height=min(1000, 150 + 20 * len(rows)),  # Tall enough for every row
         xaxis_title="Model",
         yaxis_title="Song",
         showlegend=False,
-        yaxis={"autorange": "reversed"},  # Reverse y-axis for better readability
+        yaxis={
+            "autorange": "reversed",  # Reverse y-axis for better readability
+            "categoryorder": "array",
+            "categoryarray": rows,
+        },
         yaxis_tickangle=0,  # Make song names horizontal
         margin=dict(l=20, r=20, t=40, b=20),  # Adjust margins
     )
 
-    # Update marker style
-    fig.update_traces(
-        marker=dict(
-            line=dict(width=1, color="#191414"),  # Dark border around points
-            opacity=0.7,  # Slight transparency
-        )
-    )
-
-    return fig.to_html(full_html=False)
+    return figure_html(fig)
 
 
 def create_model_diversity_plot(model_songs):
@@ -141,78 +271,47 @@ def create_model_diversity_plot(model_songs):
         margin=dict(l=20, r=20, t=40, b=20),  # Adjust margins
     )
 
-    return fig.to_html(full_html=False)
+    return figure_html(fig)
+
 
+def get_model_statistics(df, summary=None):
+    """Calculate statistics for each model.
 
-def get_model_statistics(df):
-    """Calculate statistics for each model."""
-    from spotify_utils import get_track_info
+    summary is summarize_models(df), computed here if not given.
+    """
+    from spotify_utils import get_track_infos
 
+    summary = summary or summarize_models(df)
     stats = []
+    # (song, artist) each top song / artist takes its Spotify data from,
+    # looked up together once every model has been counted
+    lookups = []
 
-    # Create song_id if it doesn't exist
-    if "song_id" not in df.columns:
-        df["song_id"] = df["song"] + " - " + df["artist"]
-
-    for model in df["model"].unique():
-        model_df = df[df["model"] == model]
-        unique_songs = len(model_df["song_id"].unique())
-        total_songs = len(model_df)
-
-        # Get top songs with Spotify data
-        top_songs = []
-        for _, row in (
-            model_df.groupby(["song", "artist"])["song"]
-            .count()
-            .reset_index(name="count")
-            .sort_values("count", ascending=False)
-            .head(10)
-            .iterrows()
-        ):
-            song_info = get_track_info(row["song"], row["artist"])
-            top_songs.append(
-                {
-                    "song": row["song"],
-                    "artist": row["artist"],
-                    "count": row["count"],
-                    "spotify_url": song_info.get("spotify_url", ""),
-                    "image_url": song_info.get("image_url", ""),
-                }
-            )
+    for model, model_summary in summary.items():
+        top_songs = [dict(song) for song in model_summary["top_songs"]]
+        for song in top_songs:
+            lookups.append((song, (song["song"], song["artist"])))
 
-        # Get top artists with Spotify data
+        # Each artist's image comes from their most picked song
         top_artists = []
-        for _, row in (
-            model_df.groupby(["artist"])["artist"]
-            .count()
-            .reset_index(name="count")
-            .sort_values("count", ascending=False)
-            .head(5)
-            .iterrows()
-        ):
-            # Get artist image from their most played song
-            artist_song = model_df[model_df["artist"] == row["artist"]].iloc[0]
-            song_info = get_track_info(artist_song["song"], row["artist"])
-            top_artists.append(
-                {
-                    "artist": row["artist"],
-                    "count": row["count"],
-                    "spotify_url": song_info.get("spotify_url", ""),
-                    "image_url": song_info.get("image_url", ""),
-                }
-            )
+        for artist in model_summary["top_artists"]:
+            top_artists.append({"artist": artist["artist"], "count": artist["count"]})
+            lookups.append((top_artists[-1], (artist["song"], artist["artist"])))
 
         stats.append(
             {
                 "model": model,
-                "unique_songs": unique_songs,
-                "total_songs": total_songs,
-                "diversity_ratio": (
-                    round(unique_songs / total_songs, 2) if total_songs > 0 else 0
-                ),
+                "unique_songs": model_summary["unique_songs"],
+                "total_songs": model_summary["total_songs"],
+                "diversity_ratio": model_summary["diversity_ratio"],
                 "top_songs": top_songs,
                 "top_artists": top_artists,
             }
         )
 
+    infos = get_track_infos(pair for _, pair in lookups)
+    for entry, pair in lookups:
+        entry["spotify_url"] = infos[pair].get("spotify_url", "")
+        entry["image_url"] = infos[pair].get("image_url", "")
+
     return pd.DataFrame(stats)
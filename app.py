@@ -1,4 +1,4 @@
-from flask import Flask, render_template, send_from_directory
+from flask import Flask, render_template, send_from_directory, abort
 import pandas as pd
 from analyze_playlists import (
     load_playlist_data,
@@ -8,8 +8,12 @@ from analyze_playlists import (
     create_model_comparison_plot,
     create_model_diversity_plot,
     get_model_statistics,
+    get_model_song_counts,
+    get_model_comparison_table,
+    get_model_comparison_page,
+    summarize_models,
 )
-from spotify_utils import enrich_playlist_data
+from spotify_utils import enrich_playlists
 from genre_analysis import (
     get_genre_statistics,
     create_genre_distribution_plot,
@@ -17,40 +21,31 @@ from genre_analysis import (
     normalize_genre,
 )
 from data_export import export_data
+from run_store import load_runs
+from page_snapshot import PageSnapshot
+from figures import PLOTLY_JS_URL, figure_html
 import os
+import json
 import shutil
 from pathlib import Path
 import plotly.express as px
 from collections import Counter
 
 app = Flask(__name__)
-
-# Export data on startup
-export_data()
+app.jinja_env.globals["plotly_js_url"] = PLOTLY_JS_URL
 
 
 def get_experiment_stats():
     """Get statistics about the experiment."""
-    outputs_dir = Path("outputs")
-    df = load_playlist_data()  # Load actual data
+    runs = load_runs()
+    runs_per_model = Counter(run["model"] for run in runs)
     stats = {
-        "total_runs": 0,
-        "total_songs": len(df),  # Use actual count from DataFrame
-        "models": [],
-        "runs_per_model": {},
+        "total_runs": len(runs),
+        "total_songs": sum(len(run["songs"]) for run in runs),
+        "models": list(runs_per_model),
+        "runs_per_model": dict(runs_per_model),
     }
 
-    # Count files per model directory
-    for model_dir in outputs_dir.iterdir():
-        if model_dir.is_dir() and not model_dir.name == "error_logs":
-            model_name = model_dir.name.replace("_", "/")
-            playlist_files = list(model_dir.glob("playlist_*.json"))
-            num_runs = len(playlist_files)
-
-            stats["models"].append(model_name)
-            stats["runs_per_model"][model_name] = num_runs
-            stats["total_runs"] += num_runs
-
     return stats
 
 
@@ -64,17 +59,25 @@ def generate_page_data():
     # Get experiment stats
     experiment_stats = get_experiment_stats()
 
+    # Per-model counts, top songs and top artists in one pass
+    model_song_counts = get_model_song_counts(df)
+    model_summary = summarize_models(df, song_counts=model_song_counts)
+
     # Get model stats
-    model_stats = get_model_statistics(df)
+    model_stats = get_model_statistics(df, model_summary)
 
     # Get song frequencies
-    song_counts = df.groupby(["song", "artist"]).size().reset_index(name="count")
-    song_counts["song_artist"] = song_counts["song"] + " - " + song_counts["artist"]
+    song_counts = (
+        df.groupby("song_id", observed=True).size().reset_index(name="count")
+    )
+    song_counts["song_artist"] = song_counts["song_id"].astype(str)
     song_counts = song_counts.sort_values("count", ascending=False)
 
     # Get artist frequencies
-    artist_counts = df["artist"].value_counts().reset_index()
-    artist_counts.columns = ["artist", "count"]
+    artist_counts = (
+        df.groupby("artist", observed=True).size().sort_values(ascending=False)
+    )
+    artist_counts = artist_counts.reset_index(name="count").astype({"artist": str})
 
     # Create frequency plots
     song_freq_plot = px.bar(
@@ -126,38 +129,37 @@ def generate_page_data():
     )
 
     # Convert plots to HTML
-    song_freq_plot = song_freq_plot.to_html(full_html=False, include_plotlyjs=False)
-    artist_freq_plot = artist_freq_plot.to_html(full_html=False, include_plotlyjs=False)
+    song_freq_plot = figure_html(song_freq_plot)
+    artist_freq_plot = figure_html(artist_freq_plot)
 
     # Get model comparison plot
-    model_comparison_plot = create_model_comparison_plot(df)
+    model_comparison_plot = create_model_comparison_plot(
+        df, song_counts=model_song_counts
+    )
     if isinstance(model_comparison_plot, str):
         model_comparison_plot_html = model_comparison_plot
     else:
-        model_comparison_plot_html = model_comparison_plot.to_html(
-            full_html=False, include_plotlyjs=False
-        )
+        model_comparison_plot_html = figure_html(model_comparison_plot)
 
     # Get model diversity plot
-    model_diversity_plot = create_model_diversity_plot(get_model_top_songs(df))
+    model_diversity_plot = create_model_diversity_plot(
+        get_model_top_songs(df, model_summary)
+    )
     if isinstance(model_diversity_plot, str):
         model_diversity_plot_html = model_diversity_plot
     else:
-        model_diversity_plot_html = model_diversity_plot.to_html(
-            full_html=False, include_plotlyjs=False
-        )
+        model_diversity_plot_html = figure_html(model_diversity_plot)
 
     # Process playlists
-    playlists = {}
-    for model in df["model"].unique():
-        model_df = df[df["model"] == model]
-        top_songs = []
-        for song_id, count in model_df["song_id"].value_counts().head(10).items():
-            song_row = model_df[model_df["song_id"] == song_id].iloc[0]
-            top_songs.append(
-                {"song": song_row["song"], "artist": song_row["artist"], "count": count}
-            )
-        playlists[model] = enrich_playlist_data(top_songs)
+    playlists = {
+        model: [
+            {"song": song["song"], "artist": song["artist"], "count": song["count"]}
+            for song in summary["top_songs"]
+        ]
+        for model, summary in model_summary.items()
+    }
+    # One bulk Spotify lookup for every model's top songs
+    enrich_playlists(playlists)
 
     # Get genre statistics and plots
     genre_analysis = get_genre_statistics(playlists)
@@ -194,15 +196,55 @@ def generate_page_data():
         "song_freq_plot": song_freq_plot,
         "artist_freq_plot": artist_freq_plot,
         "model_comparison_plot": model_comparison_plot_html,
+        "model_comparison_table": get_model_comparison_table(df, model_song_counts),
         "model_diversity_plot": model_diversity_plot_html,
         "top_genre": top_genre,
     }
 
 
+# Served while the first snapshot is built
+BUILDING_PAGE = """<!DOCTYPE html>
+<html><head><meta http-equiv="refresh" content="5"><title>LLM Jukebox</title></head>
+<body style="background:#191414;color:#fff;font-family:sans-serif">
+<p>Crunching the playlists, this page will refresh in a moment...</p>
+</body></html>"""
+
+
+def build_page():
+    """Page context and rendered HTML for the page snapshot."""
+    data = generate_page_data()
+    # Export after the page data, which looks up genres of new artists
+    export_data()
+    with app.app_context():
+        html_content = render_template("index.html", **data)
+    return data, html_content
+
+
+# Page data is computed in the background whenever the runs or caches
+# change, never while answering a request
+page_snapshot = PageSnapshot(build_page)
+
+
 @app.route("/")
 def index():
-    data = generate_page_data()
-    return render_template("index.html", **data)
+    snapshot = page_snapshot.get()
+    if snapshot is None:
+        return BUILDING_PAGE, 503, {"Retry-After": "5"}
+    return snapshot["html"]
+
+
+@app.route("/model_comparison/page-<int:page>.json")
+def model_comparison_page(page):
+    """A page of the model comparison drill-down, from the page snapshot."""
+    snapshot = page_snapshot.get()
+    if snapshot is None or "model_comparison_table" not in snapshot["context"]:
+        return {"error": "The page is still being built"}, 503, {"Retry-After": "5"}
+    comparison = get_model_comparison_page(
+        snapshot["context"]["model_comparison_table"], page
+    )
+    if not 1 <= page <= comparison["pages"]:
+        abort(404)
+    return comparison
 
 
 @app.route("/data_exports/<path:filename>")
@@ -223,17 +265,29 @@ def create_static_site(dist_dir):
     data_exports_dir = os.path.join(dist_dir, "data_exports")
     os.makedirs(data_exports_dir, exist_ok=True)
 
-    # Get all the data
-    data = generate_page_data()
-
-    # Render the template with the data
-    with app.app_context():
-        html_content = render_template("index.html", **data)
+    # Reuse the page snapshot if nothing changed since it was built, then
+    # export new runs with the genres the build looked up
+    snapshot = page_snapshot.get_fresh()
+    export_data()
+    html_content = snapshot["html"]
 
     # Write the HTML file
     with open(os.path.join(dist_dir, "index.html"), "w", encoding="utf-8") as f:
         f.write(html_content)
 
+    # Write every page of the model comparison drill-down
+    comparison_dir = os.path.join(dist_dir, "model_comparison")
+    os.makedirs(comparison_dir, exist_ok=True)
+    table = snapshot["context"]["model_comparison_table"]
+    page = 1
+    while True:
+        comparison = get_model_comparison_page(table, page)
+        with open(os.path.join(comparison_dir, f"page-{page}.json"), "w") as f:
+            json.dump(comparison, f)
+        if page >= comparison["pages"]:
+            break
+        page += 1
+
     # Copy static assets
     static_dir = os.path.join(app.root_path, "static")
     if os.path.exists(static_dir):
@@ -245,9 +299,13 @@ def create_static_site(dist_dir):
     data_dir = os.path.join(app.root_path, "data_exports")
     if os.path.exists(data_dir):
         shutil.copytree(
-            data_dir, os.path.join(dist_dir, "data_exports"), dirs_exist_ok=True
+            data_dir,
+            os.path.join(dist_dir, "data_exports"),
+            dirs_exist_ok=True,
+            ignore=shutil.ignore_patterns(".*"),
         )
 
 
 if __name__ == "__main__":
+    page_snapshot.refresh()
     app.run(debug=True, host="0.0.0.0", port=5001)
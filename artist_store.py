@@ -0,0 +1,94 @@
+from metadata_cache import FOUND, open_cache, make_entry, entry_fields
+from canonical import canonical_artist
+from canonical import flush as canonical_flush
+
+# Artist entities keyed by Spotify artist ID: {"id", "name", "genres"}
+ARTISTS_NAMESPACE = "artists"
+
+# Canonical artist name -> {"artist_id"}, or a miss entry
+ALIASES_NAMESPACE = "artist_aliases"
+
+# Name-keyed genres from before the artist store (genre_cache.json), only
+# used when a name has no alias and Spotify cannot be asked
+LEGACY_GENRES_NAMESPACE = "genres"
+
+artists = open_cache(ARTISTS_NAMESPACE)
+aliases = open_cache(ALIASES_NAMESPACE)
+legacy_genres = open_cache(LEGACY_GENRES_NAMESPACE)
+
+
+def get_artist(artist_id):
+    """The stored artist for a Spotify ID, or None."""
+    entry = artists.get(artist_id)
+    return entry_fields(entry) if entry else None
+
+
+def save_artist(artist):
+    """Store an artist object as returned by the Spotify API."""
+    fields = {
+        "id": artist["id"],
+        "name": artist["name"],
+        "genres": artist.get("genres", []),
+    }
+    artists[artist["id"]] = make_entry(FOUND, **fields)
+    return fields
+
+
+def get_alias(name):
+    """The alias entry for an artist name, or None if it was never resolved.
+
+    Names are looked up by their canonical form, so spelling variants
+    share one alias.
+    """
+    return aliases.get(canonical_artist(name))
+
+
+def save_alias(name, artist_id, status=FOUND):
+    """Point a name at an artist ID, or record a miss with artist_id=None."""
+    aliases[canonical_artist(name)] = make_entry(status, artist_id=artist_id)
+
+
+def get_legacy_genres(name):
+    """Genres cached by name before the artist store, or None."""
+    entry = legacy_genres.get(name)
+    if entry is None:
+        return None
+    # The oldest entries are plain genre lists
+    return entry if isinstance(entry, list) else entry.get("genres", [])
+
+
+def save_legacy_genres(genres_by_name):
+    legacy_genres.update_many(
+        (name, make_entry(FOUND, genres=genres))
+        for name, genres in genres_by_name.items()
+    )
+    legacy_genres.flush()
+
+
+def get_genre_map():
+    """{canonical artist name: genres} for every known name.
+
+    Names resolved to an artist take that artist's genres, so every
+    consumer sees the same genres for a name; the rest fall back to
+    their legacy entry. Look names up with canonical.canonical_artist.
+    """
+    genre_map = {
+        canonical_artist(name): (
+            entry if isinstance(entry, list) else entry.get("genres", [])
+        )
+        for name, entry in legacy_genres.items()
+    }
+    entities = dict(artists.items())
+    for name, alias in aliases.items():
+        entity = entities.get(alias.get("artist_id"))
+        if entity is not None:
+            genre_map[name] = entity.get("genres", [])
+        elif alias.get("status") != FOUND:
+            genre_map.setdefault(name, [])
+    return genre_map
+
+
+def flush():
+    artists.flush()
+    aliases.flush()
+    canonical_flush()
@@ -0,0 +1,91 @@
+import re
+import threading
+import unicodedata
+from metadata_cache import open_cache
+
+# Raw string -> canonical form, persisted so each string is normalised once
+ALIASES_NAMESPACE = "canonical_names"
+
+# Bump when the rules below change; older stored forms are recomputed
+CANONICAL_VERSION = 1
+
+# "feat. X", "(ft X)", "featuring X", "[with X]" and everything after it
+FEATURING_PATTERN = re.compile(
+    r"\s*[\(\[]?\s*\b(?:feat|ft|featuring)\b\.?.*$|\s*[\(\[]\s*with\b.*$",
+    re.IGNORECASE,
+)
+# Apostrophes are dropped so "Don't" and "Dont" match
+APOSTROPHE_PATTERN = re.compile(r"['‘’`´]")
+NON_WORD_PATTERN = re.compile(r"[^\w]+")
+THE_PREFIX_PATTERN = re.compile(r"^the\s+")
+
+_memo = {}
+_aliases = None
+_lock = threading.Lock()
+
+
+def _normalize(text):
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = FEATURING_PATTERN.sub("", text).casefold().replace("&", " and ")
+    text = APOSTROPHE_PATTERN.sub("", text)
+    return NON_WORD_PATTERN.sub(" ", text).strip()
+
+
+def _normalize_artist(name):
+    return THE_PREFIX_PATTERN.sub("", _normalize(name))
+
+
+def _get_aliases():
+    """Open the persisted alias table and load it into the memo once."""
+    global _aliases
+    if _aliases is None:
+        _aliases = open_cache(ALIASES_NAMESPACE)
+        for key, entry in _aliases.items():
+            if entry.get("version") == CANONICAL_VERSION:
+                _memo[key] = entry["canonical"]
+    return _aliases
+
+
+def _canonical(kind, raw, normalize):
+    key = f"{kind}:{raw}"
+    canonical = _memo.get(key)
+    if canonical is not None:
+        return canonical
+    with _lock:
+        aliases = _get_aliases()
+        canonical = _memo.get(key)
+        if canonical is None:
+            canonical = normalize(raw) or str(raw).strip().casefold()
+            _memo[key] = canonical
+            aliases[key] = {"canonical": canonical, "version": CANONICAL_VERSION}
+    return canonical
+
+
+def canonical_artist(name):
+    """Canonical form of an artist name.
+
+    Case, accents, punctuation, a leading "The" and featured artists are
+    dropped, so "The Beatles" and "Beatles feat. X" match.
+    """
+    return _canonical("artist", name, _normalize_artist)
+
+
+def canonical_song(title):
+    """Canonical form of a song title.
+
+    Case, accents, punctuation and featured artists are dropped, so
+    "Don't Stop Me Now" and "Dont Stop Me Now" match.
+    """
+    return _canonical("song", title, _normalize)
+
+
+def song_key(song, artist):
+    """Canonical ID of a song, used for counting and as the cache key."""
+    return f"{canonical_song(song)} - {canonical_artist(artist)}"
+
+
+def flush():
+    """Commit newly normalised strings to the alias table."""
+    if _aliases is not None:
+        _aliases.flush()
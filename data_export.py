@@ -1,58 +1,170 @@
 import os
 import json
+import shutil
+import hashlib
+import argparse
+import tempfile
 import pandas as pd
 from pathlib import Path
 from genre_analysis import load_genre_cache
+from run_store import STORE_DIR, load_runs
+from playlist_corpus import get_source_fingerprint
+from canonical import canonical_artist
+
+EXPORT_FILE = "llm_music_choices.csv"
+
+# Run store fingerprint, ids of the runs already in the CSV and digests
+# of the genres they were written with
+EXPORT_STATE_FILE = ".llm_music_choices.state.json"
+
+EXPORT_COLUMNS = ["model", "timestamp", "song", "artist", "genres"]
+
+
+def load_export_state(output_dir):
+    try:
+        with open(Path(output_dir) / EXPORT_STATE_FILE, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_atomic(path, write):
+    """Call write(f) on a temp file next to path, then rename it over path."""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w", newline="") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def get_genres_digest(genre_cache, runs=None):
+    """Digest of the genres of the given runs' artists, or of every artist."""
+    if runs is not None:
+        artists = {
+            canonical_artist(song["artist"]) for run in runs for song in run["songs"]
+        }
+        genre_cache = {artist: genre_cache.get(artist, []) for artist in artists}
+    data = json.dumps(genre_cache, sort_keys=True).encode()
+    return hashlib.sha1(data).hexdigest()
+
+
+def get_export_rows(runs, genre_cache=None):
+    """One row per song of the given runs, sorted by model and timestamp.
+
+    Also returns the ids of the runs whose rows were all collected.
+    """
+    if genre_cache is None:
+        genre_cache = load_genre_cache()
 
-def export_data(output_dir="data_exports"):
-    """Export all data in a single comprehensive CSV."""
-    # Create output directory if it doesn't exist
-    Path(output_dir).mkdir(exist_ok=True)
-    
-    # Load genre cache
-    genre_cache = load_genre_cache()
-    
     # Collect all song choices with timestamps
     all_songs = []
-    outputs_dir = Path("outputs")
-    
-    for model_dir in outputs_dir.iterdir():
-        if model_dir.is_dir() and not model_dir.name == "error_logs":
-            model_name = model_dir.name.replace('_', '/')
-            for playlist_file in model_dir.glob("playlist_*.json"):
-                try:
-                    with open(playlist_file) as f:
-                        playlist_data = json.load(f)
-                        if "songs" in playlist_data:
-                            # Extract timestamp from filename
-                            # Format: playlist_run1_20241121_161159.json
-                            timestamp = playlist_file.stem.split('_', 2)[2]  # Get '20241121_161159'
-                            timestamp = timestamp.replace('_', '')  # Convert to '20241121161159'
-                            
-                            for song in playlist_data["songs"]:
-                                # Get genres for the artist
-                                artist_genres = genre_cache.get(song["artist"], [])
-                                # Join multiple genres with semicolon
-                                genres = "; ".join(artist_genres) if artist_genres else "Unknown"
-                                
-                                all_songs.append({
-                                    "model": model_name,
-                                    "timestamp": timestamp,
-                                    "song": song["song"],
-                                    "artist": song["artist"],
-                                    "genres": genres
-                                })
-                except Exception as e:
-                    print(f"Error loading {playlist_file}: {e}")
-    
-    # Convert to DataFrame and export
-    df = pd.DataFrame(all_songs)
-    
+    exported_ids = []
+
+    for run in runs:
+        try:
+            # Timestamp format: '20241121_161159' -> '20241121161159'
+            timestamp = run["timestamp"].replace('_', '')
+
+            run_songs = []
+            for song in run["songs"]:
+                # Get genres for the artist
+                artist_genres = genre_cache.get(canonical_artist(song["artist"]), [])
+                # Join multiple genres with semicolon
+                genres = "; ".join(artist_genres) if artist_genres else "Unknown"
+
+                run_songs.append({
+                    "model": run["model"],
+                    "timestamp": timestamp,
+                    "song": song["song"],
+                    "artist": song["artist"],
+                    "genres": genres
+                })
+            all_songs.extend(run_songs)
+            exported_ids.append(run["id"])
+        except Exception as e:
+            print(f"Error exporting run {run['id']}: {e}")
+
     # Sort by model and timestamp
-    df = df.sort_values(['model', 'timestamp'])
-    
-    # Export only the CSV
-    df.to_csv(f"{output_dir}/llm_music_choices.csv", index=False)
+    df = pd.DataFrame(all_songs, columns=EXPORT_COLUMNS)
+    return df.sort_values(['model', 'timestamp'], kind="stable"), exported_ids
+
+
+def export_data(output_dir="data_exports", store_dir=STORE_DIR, full=False):
+    """Export all data in a single comprehensive CSV.
+
+    Does nothing if neither the run store nor the genres have changed
+    since the last export. Otherwise only the runs not yet exported are
+    appended, so rows are sorted by model and timestamp within each
+    export rather than across the file; full=True, a store that lost runs
+    or changed genres for an exported artist rewrites it. The CSV
+    is replaced atomically, so readers never see a half-written file.
+    Runs that fail to export are retried by the next call. Returns the
+    number of rows written.
+    """
+    # Create output directory if it doesn't exist
+    output_dir = Path(output_dir)
+    output_dir.mkdir(exist_ok=True)
+    csv_path = output_dir / EXPORT_FILE
+
+    fingerprint = get_source_fingerprint(store_dir)
+    genre_cache = load_genre_cache()
+    genre_map = get_genres_digest(genre_cache)
+    state = None if full or not csv_path.exists() else load_export_state(output_dir)
+    if (
+        state is not None
+        and state.get("fingerprint") == fingerprint
+        and state.get("genre_map") == genre_map
+    ):
+        return 0
+
+    runs = load_runs(store_dir)
+    run_ids = [run["id"] for run in runs]
+    exported = set(state["runs"]) if state is not None else set()
+    if not exported.issubset(run_ids):
+        # Runs were replaced or removed, so the old rows cannot be trusted
+        exported = set()
+    elif state is not None and state.get("genres") != get_genres_digest(
+        genre_cache, [run for run in runs if run["id"] in exported]
+    ):
+        # Genres of artists already exported were found or changed
+        exported = set()
+    new_runs = [run for run in runs if run["id"] not in exported]
+    df, new_ids = get_export_rows(new_runs, genre_cache)
+
+    def write_csv(f):
+        if exported:
+            with open(csv_path, "r", newline="") as old:
+                shutil.copyfileobj(old, f)
+        df.to_csv(f, index=False, header=not exported)
+
+    if new_runs or not exported:
+        write_atomic(csv_path, write_csv)
+    # Runs that failed are left out of the state, and so is the
+    # fingerprint, so the next export retries them
+    if len(new_ids) < len(new_runs):
+        fingerprint = None
+    written = exported.union(new_ids)
+    state = {
+        "fingerprint": fingerprint,
+        "genre_map": genre_map,
+        "genres": get_genres_digest(
+            genre_cache, [run for run in runs if run["id"] in written]
+        ),
+        "runs": sorted(written),
+    }
+    write_atomic(output_dir / EXPORT_STATE_FILE, lambda f: json.dump(state, f))
+    return len(df)
+
 
 if __name__ == "__main__":
-    export_data()
+    parser = argparse.ArgumentParser(description="Export playlists to CSV.")
+    parser.add_argument(
+        "--full", action="store_true", help="Rewrite the export from scratch"
+    )
+    args = parser.parse_args()
+    rows = export_data(full=args.full)
+    print(f"Exported {rows} new rows to data_exports/{EXPORT_FILE}")
@@ -0,0 +1,229 @@
+import json
+import re
+from pathlib import Path
+
+# Name used for the single prompt / sampling setting of a plain sweep
+DEFAULT_NAME = "default"
+
+# Token estimates used to price a run before its real usage is known
+DEFAULT_PROMPT_TOKENS = 80
+DEFAULT_COMPLETION_TOKENS = 400
+
+# Rate used to interleave models that do not declare an rpm limit
+DEFAULT_SCHEDULING_RPM = 60
+
+
+def default_experiment(models, prompt, runs):
+    """Build the spec equivalent to the constants in playlist_generator."""
+    return normalize_experiment(
+        {"name": DEFAULT_NAME, "models": models, "prompts": prompt, "runs": runs}
+    )
+
+
+def load_experiment(path):
+    """Load an experiment spec from a JSON file."""
+    with open(path, "r") as f:
+        spec = json.load(f)
+    spec.setdefault("name", Path(path).stem)
+    return normalize_experiment(spec)
+
+
+def normalize_experiment(spec):
+    """Fill in defaults and validate an experiment spec.
+
+    Models may be plain ids or dicts with "id", "prompt_price" and
+    "completion_price" (USD per million tokens) and an optional "rpm"
+    request-rate limit. Prompts and
+    sampling settings may be a single value or a dict of named variants.
+    """
+    models = []
+    for model in spec.get("models", []):
+        if isinstance(model, str):
+            model = {"id": model}
+        if "id" not in model:
+            raise ValueError(f"Model entry without an id: {model}")
+        models.append(
+            {
+                "id": model["id"],
+                "prompt_price": float(model.get("prompt_price", 0)),
+                "completion_price": float(model.get("completion_price", 0)),
+                "rpm": float(model["rpm"]) if model.get("rpm") else None,
+            }
+        )
+    if not models:
+        raise ValueError("Experiment spec needs at least one model")
+
+    prompts = spec.get("prompts", {})
+    if isinstance(prompts, str):
+        prompts = {DEFAULT_NAME: prompts}
+    if not prompts:
+        raise ValueError("Experiment spec needs at least one prompt")
+
+    sampling = spec.get("sampling") or {DEFAULT_NAME: {}}
+    if not isinstance(sampling, dict) or not all(
+        isinstance(params, dict) for params in sampling.values()
+    ):
+        sampling = {DEFAULT_NAME: sampling}
+
+    budget = spec.get("budget", {})
+
+    return {
+        "name": spec.get("name", DEFAULT_NAME),
+        "runs": int(spec.get("runs", 1)),
+        "models": models,
+        "prompts": prompts,
+        "sampling": sampling,
+        "budget": {
+            "max_cost": budget.get("max_cost"),
+            "max_tokens": budget.get("max_tokens"),
+        },
+        "estimated_prompt_tokens": spec.get(
+            "estimated_prompt_tokens", DEFAULT_PROMPT_TOKENS
+        ),
+        "estimated_completion_tokens": spec.get(
+            "estimated_completion_tokens", DEFAULT_COMPLETION_TOKENS
+        ),
+    }
+
+
+def get_cell_id(model, prompt_name, sampling_name):
+    """Identify a matrix cell; default variants are left out of the id."""
+    parts = [model] + [
+        name for name in (prompt_name, sampling_name) if name != DEFAULT_NAME
+    ]
+    return "|".join(parts)
+
+
+def get_cell_slug(prompt_name, sampling_name):
+    """Filename-safe suffix for a non-default cell, or None."""
+    names = [n for n in (prompt_name, sampling_name) if n != DEFAULT_NAME]
+    if not names:
+        return None
+    return re.sub(r"[^A-Za-z0-9.-]+", "-", "-".join(names))
+
+
+def expand_matrix(spec, runs=None):
+    """Cross models x prompts x sampling params x runs into run tasks."""
+    runs = spec["runs"] if runs is None else runs
+    tasks = []
+    for model in spec["models"]:
+        for prompt_name, prompt in spec["prompts"].items():
+            for sampling_name, params in spec["sampling"].items():
+                for run in range(1, runs + 1):
+                    tasks.append(
+                        {
+                            "experiment": spec["name"],
+                            "cell": get_cell_id(
+                                model["id"], prompt_name, sampling_name
+                            ),
+                            "model": model["id"],
+                            "prompt_name": prompt_name,
+                            "prompt": prompt,
+                            "sampling_name": sampling_name,
+                            "sampling": params,
+                            "run": run,
+                            "runs": runs,
+                        }
+                    )
+    return tasks
+
+
+def get_model_spec(spec, model_id):
+    for model in spec["models"]:
+        if model["id"] == model_id:
+            return model
+    return {"id": model_id, "prompt_price": 0.0, "completion_price": 0.0, "rpm": None}
+
+
+def get_run_cost(model_spec, prompt_tokens, completion_tokens):
+    """Cost in USD of a run, with prices given per million tokens."""
+    return (
+        prompt_tokens * model_spec["prompt_price"]
+        + completion_tokens * model_spec["completion_price"]
+    ) / 1_000_000
+
+
+def estimate_run_cost(spec, model_id):
+    return get_run_cost(
+        get_model_spec(spec, model_id),
+        spec["estimated_prompt_tokens"],
+        spec["estimated_completion_tokens"],
+    )
+
+
+def estimate_run(spec, task):
+    """Estimated (cost, tokens) of a run, used to reserve budget."""
+    tokens = spec["estimated_prompt_tokens"] + spec["estimated_completion_tokens"]
+    return estimate_run_cost(spec, task["model"]), tokens
+
+
+def schedule_tasks(spec, tasks):
+    """Order tasks by per-model rate limit and price.
+
+    Each model's runs are spread out at its own request rate, so a model
+    with a higher rpm gets proportionally more early slots; ties go to the
+    cheaper model. Within a model, every cell gets run 1 before any cell
+    gets run 2, so a sweep cut short by the budget stays balanced.
+    """
+    position = {}
+    keyed = []
+    for task in sorted(tasks, key=lambda t: (t["run"], t["cell"])):
+        model_spec = get_model_spec(spec, task["model"])
+        slot = position.get(task["model"], 0)
+        position[task["model"]] = slot + 1
+        rpm = model_spec["rpm"] or DEFAULT_SCHEDULING_RPM
+        keyed.append((slot / rpm, estimate_run_cost(spec, task["model"]), task))
+    return [task for _, _, task in sorted(keyed, key=lambda k: (k[0], k[1]))]
+
+
+class BudgetTracker:
+    """Keeps a sweep inside its cost and token budget.
+
+    Runs reserve their estimated cost before they start and settle with
+    the real usage when they finish, so concurrent runs cannot overshoot.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.max_cost = spec["budget"]["max_cost"]
+        self.max_tokens = spec["budget"]["max_tokens"]
+        self.spent_cost = 0.0
+        self.spent_tokens = 0
+        self.reserved_cost = 0.0
+        self.reserved_tokens = 0
+
+    def reserve(self, task):
+        """Reserve budget for a run; returns False if it would not fit."""
+        cost, tokens = estimate_run(self.spec, task)
+        if (
+            self.max_cost is not None
+            and self.spent_cost + self.reserved_cost + cost > self.max_cost
+        ):
+            return False
+        if (
+            self.max_tokens is not None
+            and self.spent_tokens + self.reserved_tokens + tokens > self.max_tokens
+        ):
+            return False
+        self.reserved_cost += cost
+        self.reserved_tokens += tokens
+        return True
+
+    def settle(self, task, usage):
+        """Replace a run's reservation with its actual usage; returns its cost."""
+        cost, tokens = estimate_run(self.spec, task)
+        self.reserved_cost -= cost
+        self.reserved_tokens -= tokens
+        actual_cost = get_run_cost(
+            get_model_spec(self.spec, task["model"]),
+            usage.get("prompt_tokens", 0),
+            usage.get("completion_tokens", 0),
+        )
+        self.spent_cost += actual_cost
+        self.spent_tokens += usage.get("prompt_tokens", 0) + usage.get(
+            "completion_tokens", 0
+        )
+        return actual_cost
+
+    def summary(self):
+        return f"Spent ${self.spent_cost:.4f} and {self.spent_tokens} tokens"
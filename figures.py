@@ -0,0 +1,32 @@
+import itertools
+import plotly.io as pio
+from plotly.offline import get_plotlyjs_version
+
+# The single plotly.js bundle the page loads, matching the installed plotly
+PLOTLY_JS_URL = f"https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js"
+
+# Space reserved for a figure without an explicit height, so the page
+# does not jump when it is drawn
+DEFAULT_HEIGHT = 450
+
+_figure_ids = itertools.count()
+
+
+def figure_html(fig):
+    """Embed a figure as JSON for the page's lazy loader.
+
+    Returns an empty placeholder div and the figure's data and layout in
+    a JSON script tag; templates/index.html draws each one with the
+    shared plotly.js bundle when it scrolls into view. Unlike
+    fig.to_html, no copy of plotly.js is inlined.
+    """
+    figure_id = f"figure-{next(_figure_ids)}"
+    height = fig.layout.height or DEFAULT_HEIGHT
+    # "</" would end the script tag early
+    figure_json = pio.to_json(fig, validate=False).replace("</", "<\\/")
+    return (
+        f'<div class="lazy-figure" id="{figure_id}" '
+        f'style="min-height: {height}px"></div>\n'
+        f'<script type="application/json" data-figure="{figure_id}">'
+        f"{figure_json}</script>"
+    )
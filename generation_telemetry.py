@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import socket
+import argparse
+from pathlib import Path
+import pandas as pd
+from run_store import append_jsonl
+
+# One JSONL file per host, so machines sharing outputs/ never append to
+# the same file
+TELEMETRY_DIR = "outputs/telemetry"
+
+
+def get_telemetry_path(telemetry_dir=TELEMETRY_DIR):
+    return Path(telemetry_dir) / f"{socket.gethostname()}.jsonl"
+
+
+def record_run(task, stats, status, cost, worker=None, telemetry_dir=TELEMETRY_DIR):
+    """Append one structured metrics record for a finished run."""
+    usage = stats["usage"]
+    finished = time.time()
+    record = {
+        "finished_at": finished,
+        "started_at": finished - (stats.get("wall_time") or 0),
+        "experiment": task["experiment"],
+        "cell": task["cell"],
+        "model": task["model"],
+        "prompt": task["prompt_name"],
+        "sampling": task["sampling_name"],
+        "run": task["run"],
+        "worker": worker or f"{socket.gethostname()}-{os.getpid()}",
+        "status": status,
+        "wall_time": stats.get("wall_time"),
+        "latency": stats.get("latency"),
+        "ttft": stats.get("ttft"),
+        "attempts": stats["attempts"],
+        "retries": max(0, stats["attempts"] - 1),
+        "repaired": stats.get("repaired", False),
+        "prompt_tokens": usage["prompt_tokens"],
+        "completion_tokens": usage["completion_tokens"],
+        "usage_estimated": stats.get("usage_estimated", False),
+        "cost": cost,
+        "error": stats.get("error"),
+    }
+
+    append_jsonl(get_telemetry_path(telemetry_dir), record)
+
+
+def load_telemetry(telemetry_dir=TELEMETRY_DIR, experiment=None):
+    """Load every host's telemetry into a DataFrame."""
+    records = []
+    for path in sorted(Path(telemetry_dir).glob("*.jsonl")):
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    print(f"Skipping malformed telemetry line in {path}")
+
+    df = pd.DataFrame(records)
+    if experiment is not None and not df.empty:
+        df = df[df["experiment"] == experiment]
+    return df
+
+
+def summarize_telemetry(df):
+    """Per-model throughput, tail latency, error/repair rates and cost."""
+    df = df.assign(
+        completed=df["status"] == "completed",
+        tokens=df["prompt_tokens"] + df["completion_tokens"],
+    )
+    grouped = df.groupby("model")
+    completed_latency = df[df["completed"]].groupby("model")["latency"]
+
+    span = grouped["finished_at"].max() - grouped["started_at"].min()
+    summary = pd.DataFrame(
+        {
+            "runs": grouped.size(),
+            "completed": grouped["completed"].sum(),
+            "error_rate": 1 - grouped["completed"].mean(),
+            "repair_rate": df[df["completed"]].groupby("model")["repaired"].mean(),
+            "retries_per_run": grouped["retries"].mean(),
+            "runs_per_min": grouped.size() / span.clip(lower=1) * 60,
+            "latency_p50": completed_latency.quantile(0.5),
+            "latency_p95": completed_latency.quantile(0.95),
+            "latency_p99": completed_latency.quantile(0.99),
+            "ttft_p50": df.groupby("model")["ttft"].median(),
+            "tokens": grouped["tokens"].sum(),
+            "cost": grouped["cost"].sum(),
+        }
+    )
+    summary["cost_per_playlist"] = summary["cost"] / summary["completed"].where(
+        summary["completed"] > 0
+    )
+    return summary.sort_values("latency_p95", ascending=False)
+
+
+def print_report(telemetry_dir=TELEMETRY_DIR, experiment=None):
+    df = load_telemetry(telemetry_dir, experiment)
+    if df.empty:
+        print(f"No telemetry found in {telemetry_dir}")
+        return
+
+    summary = summarize_telemetry(df)
+    with pd.option_context(
+        "display.max_columns",
+        None,
+        "display.width",
+        200,
+        "display.float_format",
+        "{:.3f}".format,
+    ):
+        print(summary)
+
+    completed = df["status"] == "completed"
+    print(f"\nTotal runs: {len(df)} ({completed.sum()} completed)")
+    print(f"Total cost: ${df['cost'].sum():.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report generation performance.")
+    parser.add_argument("--experiment", default=None, help="Only this experiment")
+    parser.add_argument("--dir", default=TELEMETRY_DIR, help="Telemetry directory")
+    args = parser.parse_args()
+    print_report(args.dir, args.experiment)
@@ -1,100 +1,96 @@
 import os
-import json
 from collections import Counter
 import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
-from spotify_utils import spotify
-
-# Cache file path
-GENRE_CACHE_FILE = "genre_cache.json"
+from genre_classifier import load_classifier
+from figures import figure_html
+import artist_store
+from spotify_utils import get_artist_genres
 
 
 def load_genre_cache():
-    """Load genre cache from file."""
-    try:
-        with open(GENRE_CACHE_FILE, "r") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
+    """Load genres as a plain {canonical artist: genres} dict."""
+    return artist_store.get_genre_map()
 
 
 def save_genre_cache(cache):
-    """Save genre cache to file."""
-    with open(GENRE_CACHE_FILE, "w") as f:
-        json.dump(cache, f, indent=2)
-
-
-# Initialize cache
-genre_cache = load_genre_cache()
-
-
-def get_artist_genres(artist_name):
-    """Get genres for an artist using Spotify API with caching."""
-    # Check cache first
-    if artist_name in genre_cache:
-        return genre_cache[artist_name]
-
-    try:
-        # Search for the artist
-        results = spotify.search(q=artist_name, type="artist", limit=1)
-        if results["artists"]["items"]:
-            genres = results["artists"]["items"][0]["genres"]
-            # Cache the result
-            genre_cache[artist_name] = genres
-            save_genre_cache(genre_cache)
-            return genres
-        return []
-    except Exception as e:
-        print(f"Error getting genres for {artist_name}: {e}")
-        # Cache empty result to avoid repeated failed requests
-        genre_cache[artist_name] = []
-        save_genre_cache(genre_cache)
-        return []
+    """Store {artist: genres} entries for names not resolved to an artist."""
+    artist_store.save_legacy_genres(cache)
+
+
+# Name-keyed genres from before the artist store
+genre_cache = artist_store.legacy_genres
 
 
 def load_and_process_genres(playlist_data):
-    """Load playlist data and get genres for each song."""
-    genre_data = []
-
-    for model_name, songs in playlist_data.items():
-        for song in songs:
-            artist_name = song["artist"]
-            genres = get_artist_genres(artist_name)
-
-            # Add each genre as a separate row for better visualization
-            for genre in genres:
-                genre_data.append(
-                    {
-                        "model": model_name,
-                        "artist": artist_name,
-                        "song": song["song"],
-                        "genre": genre,
-                    }
-                )
-
-    return pd.DataFrame(genre_data)
-
-
-def create_genre_distribution_plot(genre_df):
-    """Create a stacked bar chart showing genre distribution per model."""
-    # Normalize genres
-    genre_df = genre_df.copy()
-    genre_df["normalized_genre"] = genre_df["genre"].apply(normalize_genre)
-    
-    # Count genres per model, using normalized genres
-    genre_counts = genre_df.groupby(["model", "normalized_genre"]).size().reset_index(name="count")
-    
+    """Load playlist data and get genres for each song.
+
+    Returns one row per (model, song, genre), with the genre's main
+    category in normalized_genre. Genres are looked up once per distinct
+    artist.
+    """
+    songs = pd.DataFrame(
+        [
+            {"model": model_name, "artist": song["artist"], "song": song["song"]}
+            for model_name, model_songs in playlist_data.items()
+            for song in model_songs
+        ],
+        columns=["model", "artist", "song"],
+    )
+    artist_genres = {
+        artist: get_artist_genres(artist) for artist in songs["artist"].unique()
+    }
+
+    # Add each genre as a separate row for better visualization
+    songs["genre"] = songs["artist"].map(artist_genres)
+    genre_df = songs.explode("genre").dropna(subset=["genre"])
+    genre_df = genre_df.astype("category")
+    genre_df["model"] = genre_df["model"].cat.set_categories(list(playlist_data))
+    genre_df["normalized_genre"] = normalize_genres(genre_df["genre"])
+    return genre_df.reset_index(drop=True)
+
+
+def get_genre_matrix(genre_df, column="genre"):
+    """Model x genre song counts from one grouped count.
+
+    Models keep their playlist order; models without genres are left out.
+    """
+    if genre_df.empty:
+        return pd.DataFrame(dtype="int64")
+    return (
+        genre_df.groupby(["model", column], observed=True).size().unstack(fill_value=0)
+    )
+
+
+def normalize_genre_matrix(genre_matrix):
+    """Merge a model x genre matrix's columns into their main categories."""
+    families = normalize_genres(pd.Series(genre_matrix.columns, dtype="category"))
+    return genre_matrix.T.groupby(families.to_numpy(), sort=False).sum().T
+
+
+def create_genre_distribution_plot(genre_matrix):
+    """Create a stacked bar chart showing genre distribution per model.
+
+    genre_matrix holds model x normalized genre counts.
+    """
     # Get top 10 genres by total count across all models
-    top_genres = genre_df["normalized_genre"].value_counts().head(10).index
-    genre_counts = genre_counts[genre_counts["normalized_genre"].isin(top_genres)]
-    
-    # Calculate percentages
-    total_per_model = genre_counts.groupby("model")["count"].sum()
-    genre_counts["percentage"] = genre_counts.apply(
-        lambda x: (x["count"] / total_per_model[x["model"]]) * 100, axis=1
+    top_genres = genre_matrix.sum().nlargest(10).index
+    top_matrix = genre_matrix[top_genres]
+
+    # One row per model and genre the model actually picked
+    genre_counts = (
+        top_matrix.rename_axis(index="model", columns="normalized_genre")
+        .stack()
+        .reset_index(name="count")
+        .astype({"model": str, "normalized_genre": str})
     )
-    
+    genre_counts = genre_counts[genre_counts["count"] > 0]
+
+    # Calculate percentages of each model's top-genre songs
+    model_totals = genre_counts.groupby("model")["count"].transform("sum")
+    genre_counts["percentage"] = genre_counts["count"] / model_totals * 100
+
     # Create stacked bar chart
     fig = px.bar(
         genre_counts,
@@ -142,14 +138,14 @@ def create_genre_distribution_plot(genre_df):
         opacity=0.8
     )
     
-    return fig.to_html(full_html=False, include_plotlyjs=False)
+    return figure_html(fig)
 
 
-def create_genre_heatmap(genre_df):
-    """Create a heatmap showing genre preferences across models."""
-    # Count genres per model
-    genre_matrix = pd.crosstab(genre_df["model"], genre_df["genre"])
+def create_genre_heatmap(genre_matrix):
+    """Create a heatmap showing genre preferences across models.
 
+    genre_matrix holds model x genre counts.
+    """
     # Convert to percentages
     genre_matrix_pct = genre_matrix.div(genre_matrix.sum(axis=1), axis=0) * 100
 
@@ -179,183 +175,41 @@ def create_genre_heatmap(genre_df):
         xaxis={"tickangle": 45},
     )
 
-    return fig.to_html(full_html=False)
+    return figure_html(fig)
+
+
+# Families and super-families come from genre_taxonomy.json
+genre_classifier = load_classifier()
 
 
 def normalize_genre(genre):
     """Normalize genres to main categories."""
-    # Convert to lowercase for consistent matching
-    genre = genre.lower()
-    
-    # Genre mapping dictionary
-    genre_mapping = {
-        # Rock variants
-        'alt-rock': 'rock',
-        'alternative rock': 'rock',
-        'hard rock': 'rock',
-        'indie rock': 'rock',
-        'modern rock': 'rock',
-        'post-rock': 'rock',
-        'prog-rock': 'rock',
-        'progressive rock': 'rock',
-        'punk rock': 'rock',
-        'rock-n-roll': 'rock',
-        'soft rock': 'rock',
-        'garage rock': 'rock',
-        'grunge': 'rock',
-        'psychedelic rock': 'rock',
-        'classic rock': 'rock',
-        
-        # Pop variants
-        'art pop': 'pop',
-        'dance pop': 'pop',
-        'electropop': 'pop',
-        'indie pop': 'pop',
-        'k-pop': 'pop',
-        'synth-pop': 'pop',
-        'pop rock': 'pop',
-        'power pop': 'pop',
-        'dream pop': 'pop',
-        'chamber pop': 'pop',
-        'baroque pop': 'pop',
-        
-        # Electronic variants
-        'ambient': 'electronic',
-        'downtempo': 'electronic',
-        'drum and bass': 'electronic',
-        'dubstep': 'electronic',
-        'edm': 'electronic',
-        'electronica': 'electronic',
-        'house': 'electronic',
-        'idm': 'electronic',
-        'techno': 'electronic',
-        'trance': 'electronic',
-        'trip-hop': 'electronic',
-        'synthwave': 'electronic',
-        'electro': 'electronic',
-        
-        # Hip-hop variants
-        'rap': 'hip-hop',
-        'trap': 'hip-hop',
-        'conscious hip hop': 'hip-hop',
-        'alternative hip hop': 'hip-hop',
-        'underground hip hop': 'hip-hop',
-        'gangsta rap': 'hip-hop',
-        'old school hip hop': 'hip-hop',
-        
-        # R&B variants
-        'contemporary r&b': 'r&b',
-        'neo soul': 'r&b',
-        'soul': 'r&b',
-        'funk': 'r&b',
-        'motown': 'r&b',
-        'rhythm and blues': 'r&b',
-        
-        # Jazz variants
-        'acid jazz': 'jazz',
-        'bebop': 'jazz',
-        'big band': 'jazz',
-        'cool jazz': 'jazz',
-        'fusion': 'jazz',
-        'latin jazz': 'jazz',
-        'smooth jazz': 'jazz',
-        'swing': 'jazz',
-        'vocal jazz': 'jazz',
-        'nu jazz': 'jazz',
-        
-        # Folk variants
-        'indie folk': 'folk',
-        'folk rock': 'folk',
-        'contemporary folk': 'folk',
-        'traditional folk': 'folk',
-        'americana': 'folk',
-        'bluegrass': 'folk',
-        
-        # Metal variants
-        'black metal': 'metal',
-        'death metal': 'metal',
-        'doom metal': 'metal',
-        'heavy metal': 'metal',
-        'power metal': 'metal',
-        'progressive metal': 'metal',
-        'thrash metal': 'metal',
-        'nu metal': 'metal',
-        
-        # Classical variants
-        'baroque': 'classical',
-        'chamber music': 'classical',
-        'choral': 'classical',
-        'contemporary classical': 'classical',
-        'modern classical': 'classical',
-        'opera': 'classical',
-        'orchestral': 'classical',
-        'romantic': 'classical',
-        'symphony': 'classical',
-        
-        # Country variants
-        'alternative country': 'country',
-        'contemporary country': 'country',
-        'country rock': 'country',
-        'outlaw country': 'country',
-        'traditional country': 'country',
-        
-        # Blues variants
-        'blues rock': 'blues',
-        'chicago blues': 'blues',
-        'delta blues': 'blues',
-        'electric blues': 'blues',
-        'modern blues': 'blues',
-        
-        # Reggae variants
-        'dub': 'reggae',
-        'roots reggae': 'reggae',
-        'ska': 'reggae',
-        'dancehall': 'reggae',
-    }
-    
-    # Check direct mapping
-    if genre in genre_mapping:
-        return genre_mapping[genre]
-    
-    # Check if genre contains any of the main categories
-    main_genres = {
-        'rock', 'pop', 'electronic', 'hip-hop', 'r&b', 'jazz',
-        'folk', 'metal', 'classical', 'country', 'blues', 'reggae'
-    }
-    
-    for main_genre in main_genres:
-        if main_genre in genre:
-            return main_genre
-    
-    # Check for partial matches in mapping
-    for mapped_genre, main_genre in genre_mapping.items():
-        if mapped_genre in genre:
-            return main_genre
-    
-    return genre  # Return original if no mapping found
+    return genre_classifier.classify(genre)
+
+
+def genre_super_family(genre):
+    """The broader family a genre's main category belongs to."""
+    return genre_classifier.super_family(genre)
+
+
+def normalize_genres(genres):
+    """Normalize a whole Series of genres, once per distinct genre."""
+    return genre_classifier.classify_series(genres)
 
 
-def create_chord_diagram(genre_df):
-    """Create a chord diagram showing genre relationships between models."""
+def create_chord_diagram(genre_matrix):
+    """Create a chord diagram showing genre relationships between models.
+
+    genre_matrix holds model x normalized genre counts.
+    """
     import plotly.graph_objects as go
     import numpy as np
     
-    # Normalize genres
-    genre_df["normalized_genre"] = genre_df["genre"].apply(normalize_genre)
-    
-    # Get unique models and genres
-    models = genre_df["model"].unique()
-    genres = genre_df["normalized_genre"].value_counts().head(10).index  # Top 10 genres
-    
-    # Create a matrix of connections
-    matrix = np.zeros((len(models), len(genres)))
-    
-    # Fill the matrix with counts
-    for i, model in enumerate(models):
-        model_genres = genre_df[genre_df["model"] == model]["normalized_genre"].value_counts()
-        for j, genre in enumerate(genres):
-            if genre in model_genres:
-                matrix[i][j] = model_genres[genre]
+    # Get unique models and the top 10 genres
+    models = list(genre_matrix.index)
+    genre_counts = genre_matrix.sum()
+    genres = list(genre_counts[genre_counts > 0].nlargest(10).index)
+    matrix = genre_matrix[genres].to_numpy(dtype=float)
     
     # Define vibrant colors for models
     model_colors = [
@@ -434,7 +288,7 @@ def create_chord_diagram(genre_df):
         paper_bgcolor="rgba(0,0,0,0)",
     )
     
-    return fig.to_html(full_html=False, include_plotlyjs=False)
+    return figure_html(fig)
 
 
 def get_genre_statistics(playlists):
@@ -442,16 +296,22 @@ def get_genre_statistics(playlists):
     # Process the data
     genre_df = load_and_process_genres(playlists)
 
+    # Count every model x genre pair once; the main-category counts are
+    # summed from its columns
+    genre_matrix = get_genre_matrix(genre_df)
+    normalized_matrix = normalize_genre_matrix(genre_matrix)
+
     # Generate visualizations
-    distribution_plot = create_genre_distribution_plot(genre_df)
-    heatmap_plot = create_genre_heatmap(genre_df)
-    chord_diagram_plot = create_chord_diagram(genre_df)
+    distribution_plot = create_genre_distribution_plot(normalized_matrix)
+    heatmap_plot = create_genre_heatmap(genre_matrix)
+    chord_diagram_plot = create_chord_diagram(normalized_matrix)
 
     # Calculate some basic statistics
+    genre_totals = genre_matrix.sum()
     genre_stats = {
-        "total_genres": len(genre_df["genre"].unique()),
-        "genres_per_model": genre_df.groupby("model")["genre"].nunique().to_dict(),
-        "top_genres": genre_df["genre"].value_counts().head(5).to_dict(),
+        "total_genres": len(genre_matrix.columns),
+        "genres_per_model": (genre_matrix > 0).sum(axis=1).to_dict(),
+        "top_genres": genre_totals.nlargest(5).to_dict(),
     }
 
     return {
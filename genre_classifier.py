@@ -0,0 +1,189 @@
+import json
+import hashlib
+from collections import deque
+from metadata_cache import open_cache
+from playlist_corpus import map_categories
+
+# Sub-genre -> family -> super-family; bump "version" when editing it
+TAXONOMY_FILE = "genre_taxonomy.json"
+
+# Classified genres are kept per taxonomy and matching rules, in
+# "genre_classes:v<version>:<digest>:r<CLASSIFIER_VERSION>"
+CLASSES_NAMESPACE = "genre_classes"
+
+# Bump when the matching rules in GenreClassifier change
+CLASSIFIER_VERSION = 2
+
+
+class PatternMatcher:
+    """Aho-Corasick automaton finding every occurrence of many patterns.
+
+    Built once; a scan is a single pass over the text however many
+    patterns there are.
+    """
+
+    def __init__(self, patterns):
+        # patterns: {pattern string: value}
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for pattern, value in patterns.items():
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append((len(pattern), value))
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                if self.fail[child] == child:
+                    self.fail[child] = 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find_all(self, text):
+        """Yield (start, end, value) for every pattern occurrence."""
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length, value in self.output[state]:
+                yield i + 1 - length, i + 1, value
+
+    def find_leftmost_longest(self, text):
+        """Value of the leftmost match, the longest one on ties, or None."""
+        best = None
+        for start, end, value in self.find_all(text):
+            if best is None or (start, start - end) < (best[0], best[0] - best[1]):
+                best = (start, end, value)
+        return best[2] if best else None
+
+
+def load_taxonomy(path=TAXONOMY_FILE):
+    """Load and validate a genre taxonomy file.
+
+    The file has a "version", "super_families" mapping each super-family
+    to its families and "families" mapping each family to its
+    sub-genres. Every family belongs to exactly one super-family and
+    every sub-genre to exactly one family.
+    """
+    with open(path, "r") as f:
+        raw = f.read()
+    taxonomy = json.loads(raw)
+    if "version" not in taxonomy:
+        raise ValueError(f"Genre taxonomy without a version: {path}")
+
+    super_families = {}
+    for super_family, families in taxonomy.get("super_families", {}).items():
+        for family in families:
+            if family in super_families:
+                raise ValueError(f"Family in two super-families: {family}")
+            super_families[family] = super_family
+
+    families = {}
+    for family, sub_genres in taxonomy.get("families", {}).items():
+        if family not in super_families:
+            raise ValueError(f"Family without a super-family: {family}")
+        for sub_genre in sub_genres:
+            sub_genre = sub_genre.lower()
+            if families.get(sub_genre, family) != family:
+                raise ValueError(f"Sub-genre in two families: {sub_genre}")
+            families[sub_genre] = family
+    for family in super_families:
+        families[family.lower()] = family
+
+    return {
+        "version": taxonomy["version"],
+        "digest": hashlib.sha1(raw.encode()).hexdigest()[:12],
+        "families": families,
+        "super_families": super_families,
+    }
+
+
+class GenreClassifier:
+    """Maps Spotify genre strings to a family and super-family.
+
+    A genre is looked up in the exact-match table of family and sub-genre
+    names first, then scanned for a family name, then for any sub-genre;
+    the leftmost-longest match wins so results never depend on dict or
+    set order. Genres matching nothing are their own family.
+
+    Results are memoised per distinct genre string and, given a cache,
+    persisted there, so a later run with the same taxonomy reuses them
+    without classifying anything.
+    """
+
+    def __init__(self, taxonomy, cache=None):
+        self.version = taxonomy["version"]
+        self.exact = taxonomy["families"]
+        self.super_families = taxonomy["super_families"]
+        self.family_matcher = PatternMatcher(
+            {family: family for family in self.super_families}
+        )
+        self.sub_genre_matcher = PatternMatcher(self.exact)
+        self.cache = cache
+        self._memo = {}
+        if cache is not None:
+            self._memo.update((genre, tuple(levels)) for genre, levels in cache.items())
+
+    def classify_levels(self, genre):
+        """(family, super-family) of a genre string."""
+        levels = self._memo.get(genre)
+        if levels is None:
+            levels = self._classify(genre)
+            self._memo[genre] = levels
+            if self.cache is not None:
+                self.cache[genre] = list(levels)
+        return levels
+
+    def classify(self, genre):
+        """Family of a genre string."""
+        return self.classify_levels(genre)[0]
+
+    def super_family(self, genre):
+        """Super-family of a genre string."""
+        return self.classify_levels(genre)[1]
+
+    def _classify(self, genre):
+        lowered = genre.lower()
+        family = (
+            self.exact.get(lowered)
+            or self.family_matcher.find_leftmost_longest(lowered)
+            or self.sub_genre_matcher.find_leftmost_longest(lowered)
+        )
+        if family is None:
+            return genre, genre
+        return family, self.super_families[family]
+
+    def classify_series(self, series, level="family"):
+        """Classify a whole Series as a categorical, once per distinct value.
+
+        level is "family" or "super_family".
+        """
+        fn = self.super_family if level == "super_family" else self.classify
+        return map_categories(series, fn)
+
+    def flush(self):
+        if self.cache is not None:
+            self.cache.flush()
+
+
+def load_classifier(path=TAXONOMY_FILE):
+    """A classifier for a taxonomy file, backed by its persisted results."""
+    taxonomy = load_taxonomy(path)
+    namespace = (
+        f"{CLASSES_NAMESPACE}:v{taxonomy['version']}:{taxonomy['digest']}"
+        f":r{CLASSIFIER_VERSION}"
+    )
+    return GenreClassifier(taxonomy, open_cache(namespace))
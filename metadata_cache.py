@@ -0,0 +1,367 @@
+import os
+import json
+import time
+import atexit
+import sqlite3
+import argparse
+import threading
+from pathlib import Path
+from collections.abc import MutableMapping
+
+# Shared store for Spotify lookups; one namespace per kind of entry
+CACHE_DB = "metadata_cache.db"
+
+# "sqlite" (default) or "json" for the old one-file-per-namespace caches
+CACHE_BACKEND = os.getenv("METADATA_CACHE_BACKEND", "sqlite")
+
+# Writes are committed once this many are pending or the oldest pending
+# write is this old, and always at exit
+BATCH_SIZE = 100
+BATCH_SECONDS = 5.0
+
+# JSON files the namespaces were kept in before the SQLite cache
+JSON_CACHE_FILES = {
+    "tracks": "spotify_cache.json",
+    "genres": "genre_cache.json",
+}
+
+# Outcome of a lookup, stored in each entry's "status" with "cached_at"
+FOUND = "found"
+NOT_FOUND = "not_found"
+ERROR = "error"
+
+# Seconds each kind of entry stays valid; None keeps it forever. Misses
+# are kept long enough that page renders do not search for them again,
+# errors only briefly so an outage is retried once it is over.
+CACHE_TTLS = {
+    FOUND: None,
+    NOT_FOUND: float(os.getenv("METADATA_NOT_FOUND_TTL", 30 * 24 * 3600)),
+    ERROR: float(os.getenv("METADATA_ERROR_TTL", 3600)),
+}
+
+# Marks a pending delete in SqliteCache's write buffer
+_DELETED = object()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS cache_updated ON cache (namespace, updated);
+"""
+
+# Caches opened by this process, flushed before a fingerprint is taken
+_open_caches = []
+
+
+class SqliteCache(MutableMapping):
+    """Dict-like view of one namespace of the SQLite metadata cache.
+
+    The database runs in WAL mode, so readers in other processes never
+    block on a writer. Assignments are single-row upserts buffered in
+    memory and committed together, one short transaction per BATCH_SIZE
+    writes or BATCH_SECONDS, instead of rewriting a whole file per entry.
+    """
+
+    def __init__(self, namespace, path=CACHE_DB):
+        self.namespace = namespace
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        # key -> value (or _DELETED) not yet committed
+        self._pending = {}
+        self._batch_started = None
+        atexit.register(self.flush)
+        _open_caches.append(self)
+
+    def __getitem__(self, key):
+        with self._lock:
+            if key in self._pending:
+                value = self._pending[key]
+                if value is _DELETED:
+                    raise KeyError(key)
+                return value
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __setitem__(self, key, value):
+        self.update_many([(key, value)])
+
+    def __delitem__(self, key):
+        with self._lock:
+            self[key]
+            self._pending[key] = _DELETED
+            self._wrote()
+
+    def __iter__(self):
+        return iter([key for key, _ in self.items()])
+
+    def __len__(self):
+        with self._lock:
+            self.flush()
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+
+    def items(self):
+        """Every (key, value) in the namespace, read in one query."""
+        with self._lock:
+            self.flush()
+            rows = self._conn.execute(
+                "SELECT key, value FROM cache WHERE namespace = ?", (self.namespace,)
+            ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def update_many(self, pairs):
+        """Upsert (key, value) pairs in the current batch."""
+        with self._lock:
+            for key, value in pairs:
+                self._pending[key] = value
+            self._wrote()
+
+    def _wrote(self):
+        if self._batch_started is None:
+            self._batch_started = time.monotonic()
+        if (
+            len(self._pending) >= BATCH_SIZE
+            or time.monotonic() - self._batch_started >= BATCH_SECONDS
+        ):
+            self.flush()
+
+    def flush(self):
+        """Commit pending writes in one transaction."""
+        with self._lock:
+            if not self._pending:
+                return
+            now = time.time()
+            upserts = [
+                (self.namespace, key, json.dumps(value), now)
+                for key, value in self._pending.items()
+                if value is not _DELETED
+            ]
+            deletes = [
+                (self.namespace, key)
+                for key, value in self._pending.items()
+                if value is _DELETED
+            ]
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO cache (namespace, key, value, updated) "
+                    "VALUES (?, ?, ?, ?) ON CONFLICT (namespace, key) DO UPDATE "
+                    "SET value = excluded.value, updated = excluded.updated",
+                    upserts,
+                )
+                self._conn.executemany(
+                    "DELETE FROM cache WHERE namespace = ? AND key = ?", deletes
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            self._pending = {}
+            self._batch_started = None
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+        atexit.unregister(self.flush)
+        _open_caches.remove(self)
+
+
+class JsonFileCache(MutableMapping):
+    """The old whole-file JSON cache behind the same interface.
+
+    Writes are batched like the SQLite backend, but every flush still
+    rewrites the whole file, and processes sharing it are not safe.
+    """
+
+    def __init__(self, namespace, path=None):
+        self.namespace = namespace
+        self.path = path or JSON_CACHE_FILES.get(namespace, f"{namespace}_cache.json")
+        self._lock = threading.RLock()
+        try:
+            with open(self.path, "r") as f:
+                self._data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._data = {}
+        self._pending = 0
+        self._batch_started = None
+        atexit.register(self.flush)
+        _open_caches.append(self)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self.update_many([(key, value)])
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+            self._wrote(1)
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+    def items(self):
+        return list(self._data.items())
+
+    def update_many(self, pairs):
+        with self._lock:
+            count = 0
+            for key, value in pairs:
+                self._data[key] = value
+                count += 1
+            self._wrote(count)
+
+    def _wrote(self, count):
+        if self._batch_started is None:
+            self._batch_started = time.monotonic()
+        self._pending += count
+        if (
+            self._pending >= BATCH_SIZE
+            or time.monotonic() - self._batch_started >= BATCH_SECONDS
+        ):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                with open(self.path, "w") as f:
+                    json.dump(self._data, f, indent=2)
+            self._pending = 0
+            self._batch_started = None
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
+        _open_caches.remove(self)
+
+
+BACKENDS = {"sqlite": SqliteCache, "json": JsonFileCache}
+
+
+def open_cache(namespace, backend=None):
+    """Open a namespace of the metadata cache with the configured backend.
+
+    A new SQLite namespace is seeded from its old JSON cache file, if
+    there is one.
+    """
+    backend = backend or CACHE_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown metadata cache backend: {backend}")
+    cache = BACKENDS[backend](namespace)
+    if backend == "sqlite" and len(cache) == 0:
+        json_path = JSON_CACHE_FILES.get(namespace)
+        if json_path and Path(json_path).exists():
+            import_json_cache(json_path, cache)
+    return cache
+
+
+def get_cache_fingerprint(path=CACHE_DB, backend=None):
+    """Entry count and latest write of each namespace, as a string.
+
+    Read from the table rather than from the database file's stat: the
+    WAL file is recreated by every process that opens the database, so
+    its stat never matches across processes. Pending writes of this
+    process are flushed first.
+    """
+    backend = backend or CACHE_BACKEND
+    for cache in list(_open_caches):
+        cache.flush()
+    if backend == "json":
+        parts = []
+        for json_path in sorted(Path(".").glob("*_cache.json")):
+            stat = json_path.stat()
+            parts.append(f"{json_path}:{stat.st_size}:{stat.st_mtime_ns}")
+        return "\n".join(parts)
+    if not Path(path).exists():
+        return "-"
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        rows = conn.execute(
+            "SELECT namespace, COUNT(*), MAX(updated) FROM cache "
+            "GROUP BY namespace ORDER BY namespace"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        # The table has not been created yet
+        rows = []
+    finally:
+        conn.close()
+    return "\n".join(
+        f"{namespace}:{count}:{updated!r}" for namespace, count, updated in rows
+    )
+
+
+def make_entry(status, **fields):
+    """A cache entry recording the outcome of a lookup and when it happened."""
+    return {**fields, "status": status, "cached_at": time.time()}
+
+
+def is_fresh(entry, ttls=CACHE_TTLS):
+    """True if an entry made by make_entry has not outlived its TTL."""
+    if entry.get("status") not in ttls:
+        return False
+    ttl = ttls[entry["status"]]
+    return ttl is None or time.time() - entry.get("cached_at", 0) < ttl
+
+
+def entry_fields(entry):
+    """An entry's data without its status and timestamp."""
+    return {k: v for k, v in entry.items() if k not in ("status", "cached_at")}
+
+
+def import_json_cache(json_path, cache):
+    """Copy every entry of a JSON cache file into cache; returns the count."""
+    try:
+        with open(json_path, "r") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"Could not import {json_path}: {e}")
+        return 0
+    cache.update_many(data.items())
+    cache.flush()
+    return len(data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the metadata cache.")
+    parser.add_argument(
+        "--import-json",
+        action="store_true",
+        help="Import spotify_cache.json and genre_cache.json into the database",
+    )
+    parser.add_argument(
+        "--export-json",
+        action="store_true",
+        help="Write the database back out to the JSON cache files",
+    )
+    args = parser.parse_args()
+    for namespace, json_path in JSON_CACHE_FILES.items():
+        cache = SqliteCache(namespace)
+        if args.import_json and Path(json_path).exists():
+            count = import_json_cache(json_path, cache)
+            print(f"Imported {count} {namespace} entries from {json_path}")
+        if args.export_json:
+            with open(json_path, "w") as f:
+                json.dump(dict(sorted(cache.items())), f, indent=2)
+            print(f"Exported {namespace} entries to {json_path}")
+        print(f"{namespace}: {len(cache)} entries in {CACHE_DB}")
+        cache.close()
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from run_store import STORE_DIR
+from playlist_corpus import get_source_fingerprint
+from metadata_cache import get_cache_fingerprint
+from genre_classifier import TAXONOMY_FILE
+
+# Last built page, so a restarted server can serve it straight away
+SNAPSHOT_FILE = "outputs/page_snapshot.json"
+
+# Seconds between fingerprint checks made on the request path
+CHECK_SECONDS = float(os.getenv("PAGE_SNAPSHOT_CHECK_SECONDS", 5))
+
+# Files besides the run store and metadata cache whose changes alter the page
+WATCHED_FILES = [TAXONOMY_FILE, "templates/index.html"]
+
+
+def get_page_fingerprint(store_dir=STORE_DIR):
+    """Fingerprint of the corpus sources plus the caches and template.
+
+    Stats files and reads one indexed aggregate from the metadata cache,
+    so it is cheap enough to check on every request.
+    """
+    parts = [get_source_fingerprint(store_dir), get_cache_fingerprint()]
+    for path in WATCHED_FILES:
+        try:
+            stat = os.stat(path)
+            parts.append(f"{path}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}")
+        except FileNotFoundError:
+            parts.append(f"{path}:-")
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+
+def _to_json(value):
+    # numpy scalars in the page context
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+class PageSnapshot:
+    """The computed page context and rendered HTML, keyed by fingerprint.
+
+    get() only ever returns the snapshot already built. When it notices
+    the fingerprint has changed it starts a rebuild on a background
+    thread and keeps serving the previous snapshot until that is done.
+    build is a function returning (context, html).
+    """
+
+    def __init__(self, build, path=SNAPSHOT_FILE, fingerprint=get_page_fingerprint):
+        self.build = build
+        self.path = Path(path)
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+        self._building = False
+        self._checked = 0.0
+        # Read from SNAPSHOT_FILE on first use, not at import
+        self._loaded = False
+        self.current = None
+
+    def get(self):
+        """The latest snapshot, or None before the first build finishes."""
+        now = time.monotonic()
+        if now - self._checked >= CHECK_SECONDS:
+            self._checked = now
+            self.refresh()
+        return self.current
+
+    def refresh(self):
+        """Start a background rebuild if the fingerprint has changed."""
+        self._load_once()
+        fingerprint = self.fingerprint()
+        if self.current is not None and self.current["fingerprint"] == fingerprint:
+            return False
+        with self._lock:
+            if self._building:
+                return False
+            self._building = True
+        threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+        return True
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            print(f"Error building page snapshot: {e}")
+        finally:
+            with self._lock:
+                self._building = False
+
+    def rebuild(self):
+        """Build and save a snapshot on the calling thread.
+
+        The fingerprint is taken after the build, since building writes
+        to the metadata cache that the fingerprint watches.
+        """
+        context, html = self.build()
+        fingerprint = self.fingerprint()
+        snapshot = {
+            "fingerprint": fingerprint,
+            "built_at": time.time(),
+            "context": context,
+            "html": html,
+        }
+        self.current = snapshot
+        self._save(snapshot)
+        return snapshot
+
+    def get_fresh(self):
+        """The current snapshot if it is up to date, else a new one."""
+        self._load_once()
+        if (
+            self.current is not None
+            and self.current["fingerprint"] == self.fingerprint()
+        ):
+            return self.current
+        return self.rebuild()
+
+    def _load_once(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    snapshot = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                return
+            if self.current is None:
+                self.current = snapshot
+
+    def _save(self, snapshot):
+        """Write the snapshot via a temp file and os.replace."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.path.parent, prefix=f".{self.path.name}."
+        )
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, default=_to_json)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
@@ -0,0 +1,228 @@
+import os
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from canonical import CANONICAL_VERSION, canonical_artist, song_key
+from canonical import flush as canonical_flush
+from run_store import STORE_DIR, get_store_fingerprint, load_runs
+
+# Columnar copy of the run store with one row per chosen song
+CORPUS_FILE = "outputs/corpus.parquet"
+
+# Columns stored dictionary-encoded and loaded as pandas categoricals
+CATEGORICAL_COLUMNS = [
+    "experiment",
+    "cell",
+    "model",
+    "run_id",
+    "timestamp",
+    "song",
+    "artist",
+    "song_id",
+    "song_key",
+    "artist_key",
+]
+
+# Bump when the corpus columns change so older Parquet files are rebuilt
+CORPUS_VERSION = 2
+
+# Parquet schema metadata key holding the run store fingerprint
+FINGERPRINT_KEY = b"run_store_fingerprint"
+
+# (fingerprint, DataFrame) per corpus path, see load_corpus
+_corpus_memo = {}
+_corpus_lock = threading.Lock()
+
+
+def canonicalize_songs(df):
+    """Canonical keys and display names for a song/artist frame.
+
+    Every distinct raw (song, artist) pair is normalised once through
+    the canonical module. Variants of the same song or artist are then
+    shown under their most common spelling. Returns categorical columns
+    song, artist (display names), song_key, artist_key and song_id
+    ("<song> - <artist>").
+    """
+    groups = df.groupby(["song", "artist"], observed=True, sort=False)
+    pair_codes = groups.ngroup().to_numpy()
+    pairs = groups.size().reset_index(name="n").astype({"song": str, "artist": str})
+    pairs["artist_key"] = [canonical_artist(a) for a in pairs["artist"]]
+    pairs["song_key"] = [song_key(s, a) for s, a in zip(pairs["song"], pairs["artist"])]
+    canonical_flush()
+
+    def most_common(key, name):
+        counts = pairs.groupby([key, name])["n"].sum()
+        return {k: v for k, v in counts.groupby(level=0).idxmax().values}
+
+    display_artist = pairs["artist_key"].map(most_common("artist_key", "artist"))
+    display_song = pairs["song_key"].map(most_common("song_key", "song"))
+    columns = {
+        "song": display_song,
+        "artist": display_artist,
+        "song_key": pairs["song_key"],
+        "artist_key": pairs["artist_key"],
+        "song_id": display_song + " - " + display_artist,
+    }
+    result = {}
+    for name, values in columns.items():
+        codes, categories = pd.factorize(values)
+        result[name] = pd.Series(
+            pd.Categorical.from_codes(codes[pair_codes], categories=categories),
+            index=df.index,
+            name=name,
+        )
+    return result
+
+
+def make_song_id(df):
+    """Categorical "<song> - <artist>" column, one per canonical song."""
+    return canonicalize_songs(df)["song_id"]
+
+
+def map_categories(series, fn):
+    """Apply fn to each distinct value of a categorical series.
+
+    Returns a categorical series; fn may map several values to the same
+    result.
+    """
+    series = series.astype("category")
+    category_codes, categories = pd.factorize(series.cat.categories.map(fn))
+    codes = series.cat.codes.to_numpy()
+    return pd.Series(
+        pd.Categorical.from_codes(
+            np.where(codes >= 0, category_codes[codes], -1), categories=categories
+        ),
+        index=series.index,
+        name=series.name,
+    )
+
+
+def build_corpus(runs=None):
+    """Flatten run records into a categorical DataFrame, one row per song.
+
+    song and artist hold the display spelling of each canonical song and
+    artist; the raw spellings stay in the run store.
+    """
+    if runs is None:
+        runs = load_runs()
+
+    columns = {
+        name: []
+        for name in CATEGORICAL_COLUMNS
+        if name not in ("song_id", "song_key", "artist_key")
+    }
+    columns["run"] = []
+    for run in runs:
+        for song in run["songs"]:
+            if not isinstance(song, dict) or "song" not in song or "artist" not in song:
+                continue
+            columns["experiment"].append(run["experiment"])
+            columns["cell"].append(run["cell"])
+            columns["model"].append(run["model"])
+            columns["run_id"].append(run["id"])
+            columns["timestamp"].append(run["timestamp"])
+            columns["run"].append(run["run"])
+            columns["song"].append(str(song["song"]))
+            columns["artist"].append(str(song["artist"]))
+
+    df = pd.DataFrame(columns)
+    df["run"] = df["run"].astype("int32")
+    for name, values in canonicalize_songs(df).items():
+        df[name] = values
+    return df.astype({name: "category" for name in CATEGORICAL_COLUMNS})
+
+
+def save_corpus(df, path=CORPUS_FILE, fingerprint=None):
+    """Write the corpus as Parquet via a temp file and os.replace.
+
+    The run store fingerprint it was built from is kept in the file's
+    schema metadata.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if fingerprint is not None:
+        metadata = dict(table.schema.metadata or {})
+        metadata[FINGERPRINT_KEY] = fingerprint.encode()
+        table = table.replace_schema_metadata(metadata)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    os.close(fd)
+    try:
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def get_source_fingerprint(store_dir=STORE_DIR):
+    """Fingerprint of everything the corpus is built from.
+
+    Covers the run store segments plus the corpus and canonicalisation
+    versions, so a change to either rule set also rebuilds the file.
+    """
+    versions = f"{CORPUS_VERSION}.{CANONICAL_VERSION}"
+    return f"{versions}:{get_store_fingerprint(store_dir)}"
+
+
+def get_corpus_fingerprint(path=CORPUS_FILE):
+    """Fingerprint stored in a corpus file, or None if there is none."""
+    try:
+        import pyarrow.parquet as pq
+
+        metadata = pq.read_schema(path).metadata or {}
+    except (ImportError, OSError):
+        return None
+    fingerprint = metadata.get(FINGERPRINT_KEY)
+    return fingerprint.decode() if fingerprint else None
+
+
+def load_corpus(path=CORPUS_FILE, store_dir=STORE_DIR):
+    """Load the song corpus for the current state of the run store.
+
+    The result is memoised against the store fingerprint, so repeated
+    calls with nothing new in the store only stat the segments. On a
+    cold start the Parquet file is used if it matches the fingerprint,
+    otherwise the changed segments are ingested and the file rewritten.
+    """
+    if not Path(store_dir).exists():
+        # Migrates the old outputs tree before it is fingerprinted
+        load_runs(store_dir)
+    fingerprint = get_source_fingerprint(store_dir)
+
+    key = str(Path(path).resolve())
+    with _corpus_lock:
+        cached = _corpus_memo.get(key)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1].copy(deep=False)
+
+        if get_corpus_fingerprint(path) == fingerprint:
+            df = pd.read_parquet(path)
+        else:
+            df = build_corpus(load_runs(store_dir))
+            try:
+                save_corpus(df, path, fingerprint)
+            except ImportError as e:
+                # Parquet needs pyarrow; the in-memory corpus still works
+                print(f"Not caching corpus to {path}: {e}")
+
+        _corpus_memo[key] = (fingerprint, df)
+        return df.copy(deep=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the Parquet song corpus.")
+    parser.add_argument("--path", default=CORPUS_FILE, help="Corpus file")
+    args = parser.parse_args()
+    fingerprint = get_source_fingerprint()
+    df = build_corpus()
+    save_corpus(df, args.path, fingerprint)
+    memory = df.memory_usage(deep=True).sum() / 1024**2
+    print(f"Wrote {len(df)} songs to {args.path} ({memory:.1f} MiB in memory)")
@@ -1,16 +1,62 @@
 import os
+import argparse
+import asyncio
+import time
+import random
+import tempfile
+import socket
+import threading
+from collections import defaultdict
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, APIConnectionError
 import json
 from pathlib import Path
 from datetime import datetime
 import sys
 from json_repair import repair_json
+from run_manifest import (
+    MANIFEST_FILE,
+    IN_FLIGHT,
+    COMPLETED,
+    FAILED,
+    run_key,
+    write_json_atomic,
+    load_manifest,
+    mark_run,
+    pending_tasks,
+)
+from work_queue import (
+    QUEUE_FILE,
+    DEFAULT_LEASE_SECONDS,
+    open_queue,
+    enqueue_tasks,
+    claim_task,
+    heartbeat,
+    complete_task,
+    fail_task,
+    requeue_failed,
+    get_queue_counts,
+)
+from generation_telemetry import record_run
+from run_store import append_run, ensure_migrated, make_run_record
+from experiment_spec import (
+    DEFAULT_NAME,
+    BudgetTracker,
+    default_experiment,
+    estimate_run,
+    expand_matrix,
+    get_cell_slug,
+    get_model_spec,
+    get_run_cost,
+    load_experiment,
+    schedule_tasks,
+)
 
 # Load environment variables
 load_dotenv()
 
-# Define models
+# Define models (used when no --experiment spec is given)
 MODELS = [
     # "anthropic/claude-3-5-haiku",
     # "anthropic/claude-3.5-sonnet",
@@ -27,8 +73,40 @@ MODELS = [
 # Number of runs per model
 RUNS_PER_MODEL = 40
 
-# Whether to pause on error
-PAUSE_ON_ERROR = True
+# Retry policy for API and JSON errors
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+# A 429 asking for a longer wait than this fails the run instead
+MAX_RETRY_AFTER_SECONDS = 120.0
+
+# Runs that still fail after retrying are appended here instead of pausing
+DEAD_LETTER_FILE = "dead_letter.jsonl"
+
+# Also write each run to outputs/<model>/playlist_run*.json (the run store
+# in outputs/runs/ is always written)
+WRITE_RUN_FILES = False
+
+# Stream completions and stop reading once the JSON playlist is complete
+STREAM_COMPLETIONS = False
+
+# Songs the prompt asks for; a streamed playlist is complete at this many
+PLAYLIST_LENGTH = 10
+
+# Seconds an idle worker waits before polling the shared queue again
+WORKER_POLL_SECONDS = 5
+
+# Default caps for the async generation mode
+DEFAULT_CONCURRENCY = 8
+DEFAULT_PER_MODEL_CONCURRENCY = 4
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+PROMPT = 'Give me a playlist in song - artist format for 10 songs based on how you feel. Nothing else, just songs in json I mentioned. nothing else. For example, the following is a valid response: {"songs": [{ "song": "", "artist": "" }]} .'
+
+# Shared keep-alive clients, created lazily (one per process)
+_client = None
+_async_client = None
 
 
 def ensure_output_directory():
@@ -37,128 +115,1036 @@ def ensure_output_directory():
     return base_dir
 
 
-def get_output_filepath(model_name, run_number):
+def get_run_id(model_name, run_number, cell_slug=None):
+    """Name a run "<model dir>/playlist_run<n>_<timestamp>[_<cell>]"."""
     # Create a clean model name for filesystem
     clean_model_name = model_name.replace("/", "_")
 
     # Create timestamp
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-    # Create model-specific directory
-    base_dir = ensure_output_directory()
-    model_dir = base_dir / clean_model_name
-    model_dir.mkdir(exist_ok=True)
+    # Run number and timestamp (plus the cell for matrix runs)
+    suffix = f"_{cell_slug}" if cell_slug else ""
+    return f"{clean_model_name}/playlist_run{run_number}_{timestamp}{suffix}"
 
-    # Create filename with timestamp and run number
-    filename = f"playlist_run{run_number}_{timestamp}.json"
-    return model_dir / filename
 
+def get_output_filepath(run_id):
+    """Path of the legacy per-run JSON file for a run id."""
+    filepath = ensure_output_directory() / f"{run_id}.json"
+    filepath.parent.mkdir(exist_ok=True)
+    return filepath
 
-def create_playlist(model):
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1", api_key=os.getenv("OPENROUTER_API_KEY")
-    )
 
-    try:
-        completion = client.chat.completions.create(
-            model=model,
-            response_format={"type": "json_object"},
-            messages=[
-                {
-                    "role": "user",
-                    "content": 'Give me a playlist in song - artist format for 10 songs based on how you feel. Nothing else, just songs in json I mentioned. nothing else. For example, the following is a valid response: {"songs": [{ "song": "", "artist": "" }]} .',
-                }
-            ],
+def get_client():
+    """Return the process-wide OpenRouter client, creating it on first use."""
+    global _client
+    if _client is None:
+        # Retries are handled by create_playlist so they can honour Retry-After
+        _client = OpenAI(
+            base_url=OPENROUTER_BASE_URL,
+            api_key=os.getenv("OPENROUTER_API_KEY"),
+            max_retries=0,
         )
+    return _client
 
-        response = completion.choices[0].message.content
+
+def get_async_client():
+    """Return the process-wide async OpenRouter client."""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncOpenAI(
+            base_url=OPENROUTER_BASE_URL,
+            api_key=os.getenv("OPENROUTER_API_KEY"),
+            max_retries=0,
+        )
+    return _async_client
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+
+
+def is_retryable_error(error):
+    """Rate limits, timeouts, connection drops and 5xx responses are retried."""
+    if isinstance(error, APIConnectionError):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status in (408, 409, 429) or status >= 500)
+
+
+def get_retry_after(error):
+    """Return the server-requested wait in seconds, if the error carries one."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        retry_after = headers.get("retry-after")
+        if not retry_after:
+            return None
         try:
-            # First try regular json parsing
-            return json.loads(response), response
+            return float(retry_after)
+        except ValueError:
+            retry_at = parsedate_to_datetime(retry_after)
+            return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def get_retry_delay(attempt, error=None):
+    """Exponential backoff with full jitter, never shorter than Retry-After.
+
+    Returns None if Retry-After asks for more than MAX_RETRY_AFTER_SECONDS,
+    in which case the run should not be retried.
+    """
+    backoff = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1))
+    delay = random.uniform(0, backoff)
+    retry_after = get_retry_after(error) if error is not None else None
+    if retry_after is not None:
+        if retry_after > MAX_RETRY_AFTER_SECONDS:
+            return None
+        delay = max(delay, retry_after)
+    return delay
+
+
+def parse_playlist_response(response, stats=None):
+    """Parse a model response, falling back to json_repair when needed.
+
+    If stats is given, stats["repaired"] records whether repair was needed.
+    """
+    if stats is not None:
+        stats["repaired"] = False
+    try:
+        # First try regular json parsing
+        playlist = json.loads(response)
+    except (json.JSONDecodeError, TypeError):
+        try:
+            # If regular parsing fails, try to repair the JSON
+            repaired_json = repair_json(response)
+            print(f"\n{'!'*50}")
+            print("Original JSON was malformed, but repaired successfully.")
+            print(f"Original response:\n{response}")
+            print(f"Repaired JSON:\n{repaired_json}")
+            print(f"{'!'*50}\n")
+
+            playlist = json.loads(repaired_json)
+            if stats is not None:
+                stats["repaired"] = True
+        except Exception as e:
+            print(f"\n{'!'*50}")
+            print(f"JSON Repair Error: {str(e)}")
+            print("Raw response:")
+            print(f"{response}")
+            print(f"{'!'*50}\n")
+            return None
+
+    if not isinstance(playlist, dict) or not playlist.get("songs"):
+        print(f"✗ Response has no songs: {response}")
+        return None
+    return playlist
+
+
+class JsonObjectTracker:
+    """Incrementally finds the end of the streamed playlist object.
+
+    Text is fed in as it streams; braces inside strings are ignored. A
+    top-level object only counts once it parses to {"songs": [...]} with
+    at least min_songs entries, so a preamble object or a short list does
+    not end the stream; tracking moves on to the next object instead.
+    """
+
+    def __init__(self, min_songs=PLAYLIST_LENGTH):
+        self.min_songs = min_songs
+        self.text = ""
+        self.start = None
+        self.end = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk):
+        """Add streamed text; returns True once the playlist is complete."""
+        offset = len(self.text)
+        self.text += chunk
+        if self.end is not None:
+            return True
+
+        for i, char in enumerate(chunk, offset):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = self.start is not None
+            elif char == "{":
+                if self.start is None:
+                    self.start = i
+                self._depth += 1
+            elif char == "}" and self.start is not None:
+                self._depth -= 1
+                if self._depth == 0:
+                    if self._is_playlist(self.text[self.start : i + 1]):
+                        self.end = i + 1
+                        return True
+                    self.start = None
+        return False
+
+    def _is_playlist(self, text):
+        try:
+            obj = json.loads(text)
         except json.JSONDecodeError:
-            try:
-                # If regular parsing fails, try to repair the JSON
-                repaired_json = repair_json(response)
-                print(f"\n{'!'*50}")
-                print("Original JSON was malformed, but repaired successfully.")
-                print(f"Original response:\n{response}")
-                print(f"Repaired JSON:\n{repaired_json}")
-                print(f"{'!'*50}\n")
-
-                parsed_json = json.loads(repaired_json)
-                return parsed_json, response
-            except Exception as e:
-                print(f"\n{'!'*50}")
-                print(f"JSON Repair Error: {str(e)}")
-                print("Raw response:")
-                print(f"{response}")
-                print(f"{'!'*50}\n")
-                if PAUSE_ON_ERROR:
-                    input("Press Enter to continue or Ctrl+C to abort...")
-                return None, response
-
-    except Exception as e:
-        print(f"\n{'!'*50}")
-        print(f"API Error: {str(e)}")
-        print(f"{'!'*50}\n")
-        if PAUSE_ON_ERROR:
-            input("Press Enter to continue or Ctrl+C to abort...")
-        return None, str(e)
+            return False
+        if not isinstance(obj, dict):
+            return False
+        songs = obj.get("songs")
+        return isinstance(songs, list) and len(songs) >= self.min_songs
+
+    def get_object_text(self):
+        return self.text[self.start : self.end]
+
+
+def _completion_kwargs(model, prompt, sampling, stream=False):
+    kwargs = {
+        **(sampling or {}),
+        "model": model,
+        "response_format": {"type": "json_object"},
+        "messages": [{"role": "user", "content": prompt}],
+    }
+    if stream:
+        kwargs["stream"] = True
+        kwargs["stream_options"] = {"include_usage": True}
+    return kwargs
+
+
+def _add_usage(stats, usage):
+    """Accumulate token usage; failed attempts are billed too."""
+    if usage is None:
+        return
+    stats["usage"]["prompt_tokens"] += usage.prompt_tokens or 0
+    stats["usage"]["completion_tokens"] += usage.completion_tokens or 0
+
+
+def _new_stats():
+    return {
+        "attempts": 0,
+        "error": None,
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0},
+        "usage_estimated": False,
+        "repaired": False,
+        "ttft": None,
+        "latency": None,
+        "wall_time": None,
+        "stream_closed_early": False,
+    }
+
+
+def _handle_stream_chunk(chunk, tracker, stats, started):
+    """Process one streamed chunk; returns True when the stream can be closed."""
+    if chunk.usage is not None:
+        _add_usage(stats, chunk.usage)
+        stats["usage_reported"] = True
+    if not chunk.choices:
+        return False
+    content = chunk.choices[0].delta.content
+    if not content:
+        return False
+    if stats["ttft"] is None:
+        stats["ttft"] = time.perf_counter() - started
+    stats["streamed_chunks"] += 1
+    return tracker.feed(content)
+
+
+def _finish_stream(tracker, stats, prompt, closed_early):
+    """Return the response text and estimate usage if the stream was cut."""
+    stats["stream_closed_early"] = closed_early
+    if not stats.pop("usage_reported"):
+        # Usage only arrives in the final chunk; roughly one token per chunk
+        stats["usage"]["prompt_tokens"] += len(prompt) // 4
+        stats["usage"]["completion_tokens"] += stats["streamed_chunks"]
+        stats["usage_estimated"] = True
+    stats.pop("streamed_chunks")
+    if tracker.end is not None:
+        return tracker.get_object_text()
+    return tracker.text
+
+
+def _request_completion(client, model, prompt, sampling, stats, stream):
+    """Make one API call and return the response text.
+
+    In streaming mode the stream is closed as soon as a JSON object with
+    the full list of songs is complete, so trailing chatter is neither
+    waited for nor generated.
+    """
+    started = time.perf_counter()
+    stats["ttft"] = None
+    kwargs = _completion_kwargs(model, prompt, sampling, stream)
+
+    if not stream:
+        completion = client.chat.completions.create(**kwargs)
+        stats["latency"] = time.perf_counter() - started
+        _add_usage(stats, completion.usage)
+        return completion.choices[0].message.content
+
+    tracker = JsonObjectTracker()
+    stats["streamed_chunks"] = 0
+    stats["usage_reported"] = False
+    closed_early = False
+    response_stream = client.chat.completions.create(**kwargs)
+    try:
+        for chunk in response_stream:
+            if _handle_stream_chunk(chunk, tracker, stats, started):
+                closed_early = True
+                break
+    finally:
+        response_stream.close()
+    stats["latency"] = time.perf_counter() - started
+    return _finish_stream(tracker, stats, prompt, closed_early)
+
+
+async def _request_completion_async(client, model, prompt, sampling, stats, stream):
+    """Async counterpart of _request_completion."""
+    started = time.perf_counter()
+    stats["ttft"] = None
+    kwargs = _completion_kwargs(model, prompt, sampling, stream)
+
+    if not stream:
+        completion = await client.chat.completions.create(**kwargs)
+        stats["latency"] = time.perf_counter() - started
+        _add_usage(stats, completion.usage)
+        return completion.choices[0].message.content
+
+    tracker = JsonObjectTracker()
+    stats["streamed_chunks"] = 0
+    stats["usage_reported"] = False
+    closed_early = False
+    response_stream = await client.chat.completions.create(**kwargs)
+    try:
+        async for chunk in response_stream:
+            if _handle_stream_chunk(chunk, tracker, stats, started):
+                closed_early = True
+                break
+    finally:
+        await response_stream.close()
+    stats["latency"] = time.perf_counter() - started
+    return _finish_stream(tracker, stats, prompt, closed_early)
+
+
+def create_playlist(model, prompt=PROMPT, sampling=None, stream=None):
+    """Request a playlist, retrying transient API and JSON failures.
+
+    Returns (playlist, raw_response, stats); playlist is None once every
+    attempt has failed. stats records the attempts, token usage, latency,
+    time to first token (streaming only) and last error.
+    """
+    stream = STREAM_COMPLETIONS if stream is None else stream
+    client = get_client()
+    stats = _new_stats()
+    raw_response = None
+    started = time.perf_counter()
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        stats["attempts"] = attempt
+        try:
+            raw_response = _request_completion(
+                client, model, prompt, sampling, stats, stream
+            )
+        except Exception as e:
+            print(f"✗ API Error for {model} (attempt {attempt}/{MAX_ATTEMPTS}): {e}")
+            raw_response = str(e)
+            stats["error"] = f"API Error: {e}"
+            if not is_retryable_error(e) or attempt == MAX_ATTEMPTS:
+                break
+            delay = get_retry_delay(attempt, e)
+            if delay is None:
+                print(
+                    f"✗ {model} asked for a retry after more than "
+                    f"{MAX_RETRY_AFTER_SECONDS:.0f}s, giving up"
+                )
+                break
+            time.sleep(delay)
+            continue
+
+        playlist = parse_playlist_response(raw_response, stats)
+        if playlist:
+            stats["error"] = None
+            break
+
+        stats["error"] = "JSON Error: response could not be parsed or repaired"
+        if attempt < MAX_ATTEMPTS:
+            time.sleep(get_retry_delay(attempt))
+
+    stats["wall_time"] = time.perf_counter() - started
+    if stats["error"]:
+        return None, raw_response, stats
+    return playlist, raw_response, stats
+
+
+async def create_playlist_async(model, prompt=PROMPT, sampling=None, stream=None):
+    """Async counterpart of create_playlist with the same retry policy."""
+    stream = STREAM_COMPLETIONS if stream is None else stream
+    client = get_async_client()
+    stats = _new_stats()
+    raw_response = None
+    started = time.perf_counter()
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        stats["attempts"] = attempt
+        try:
+            raw_response = await _request_completion_async(
+                client, model, prompt, sampling, stats, stream
+            )
+        except Exception as e:
+            print(f"✗ API Error for {model} (attempt {attempt}/{MAX_ATTEMPTS}): {e}")
+            raw_response = str(e)
+            stats["error"] = f"API Error: {e}"
+            if not is_retryable_error(e) or attempt == MAX_ATTEMPTS:
+                break
+            delay = get_retry_delay(attempt, e)
+            if delay is None:
+                print(
+                    f"✗ {model} asked for a retry after more than "
+                    f"{MAX_RETRY_AFTER_SECONDS:.0f}s, giving up"
+                )
+                break
+            await asyncio.sleep(delay)
+            continue
+
+        playlist = parse_playlist_response(raw_response, stats)
+        if playlist:
+            stats["error"] = None
+            break
+
+        stats["error"] = "JSON Error: response could not be parsed or repaired"
+        if attempt < MAX_ATTEMPTS:
+            await asyncio.sleep(get_retry_delay(attempt))
+
+    stats["wall_time"] = time.perf_counter() - started
+    if stats["error"]:
+        return None, raw_response, stats
+    return playlist, raw_response, stats
 
 
 def save_playlist(playlist, filepath):
-    with open(filepath, "w") as f:
-        json.dump(playlist, f, indent=2)
+    write_json_atomic(playlist, filepath)
+
+
+def get_dead_letter_path():
+    return ensure_output_directory() / DEAD_LETTER_FILE
+
+
+def save_dead_letter(task, raw_response, stats):
+    """Append a run that failed after all retries to the dead-letter queue."""
+    record = {
+        "experiment": task["experiment"],
+        "cell": task["cell"],
+        "model": task["model"],
+        "run": task["run"],
+        "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
+        "attempts": stats.get("attempts"),
+        "error": stats.get("error"),
+        "raw_response": None if raw_response is None else str(raw_response),
+    }
+    dead_letter_path = get_dead_letter_path()
+    with open(dead_letter_path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+    print(f"Dead letter saved to: {dead_letter_path}")
+
+
+def read_dead_letters(experiment):
+    """The experiment's dead-letter lines, each with the run key it is for.
+
+    Cell ids repeat across experiments, so entries of other experiments
+    are left out. Entries from before experiments were recorded belong
+    to the default one.
+    """
+    dead_letter_path = get_dead_letter_path()
+    if not dead_letter_path.exists():
+        return []
+
+    entries = []
+    with open(dead_letter_path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                if record.get("experiment", DEFAULT_NAME) != experiment:
+                    continue
+                key = run_key(record.get("cell", record["model"]), record["run"])
+                entries.append((line, key))
+    return entries
+
 
+def release_dead_letters(entries, replayed_keys):
+    """Drop replayed entries from the dead-letter queue once a replay is over.
 
-def save_error_log(model, run_number, raw_response):
-    # Create error logs directory
-    base_dir = ensure_output_directory()
-    error_dir = base_dir / "error_logs"
-    error_dir.mkdir(exist_ok=True)
+    Only the entries read before the replay whose run actually ran again
+    are removed and archived in dead_letter_replayed_<timestamp>.jsonl;
+    entries the replay skipped, and failures it added, stay queued.
+    """
+    replayed = {line for line, key in entries if key in replayed_keys}
+    if not replayed:
+        return 0
+
+    dead_letter_path = get_dead_letter_path()
+    with open(dead_letter_path) as f:
+        lines = f.readlines()
+    kept = [line for line in lines if line not in replayed]
 
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    error_file = (
-        error_dir / f"error_{model.replace('/', '_')}_run{run_number}_{timestamp}.txt"
+    archive_path = dead_letter_path.with_name(
+        f"{dead_letter_path.stem}_replayed_{timestamp}.jsonl"
+    )
+    with open(archive_path, "a") as f:
+        f.writelines(line for line in lines if line in replayed)
+
+    fd, tmp_path = tempfile.mkstemp(
+        dir=dead_letter_path.parent, prefix=f".{dead_letter_path.name}."
+    )
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.writelines(kept)
+        os.replace(tmp_path, dead_letter_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(lines) - len(kept)
+
+
+def get_task_run_id(task):
+    return get_run_id(
+        task["model"],
+        task["run"],
+        get_cell_slug(task["prompt_name"], task["sampling_name"]),
+    )
+
+
+def save_run(playlist, task, stats, run_id):
+    """Append a finished run to the run store.
+
+    With WRITE_RUN_FILES the playlist is also written to the old
+    outputs/<model>/playlist_run*.json location.
+    """
+    playlist = add_run_info(playlist, task, stats)
+    append_run(make_run_record(run_id, playlist, task["model"]))
+    if WRITE_RUN_FILES:
+        save_playlist(playlist, get_output_filepath(run_id))
+
+
+def add_run_info(playlist, task, stats):
+    """Record the matrix cell and request telemetry inside the playlist."""
+    playlist["experiment"] = {
+        "name": task["experiment"],
+        "cell": task["cell"],
+        "model": task["model"],
+        "prompt": task["prompt_name"],
+        "sampling": task["sampling_name"],
+        "params": task["sampling"],
+        "run": task["run"],
+    }
+    playlist["telemetry"] = {
+        "attempts": stats["attempts"],
+        "ttft": stats["ttft"],
+        "latency": stats["latency"],
+        "wall_time": stats["wall_time"],
+        "prompt_tokens": stats["usage"]["prompt_tokens"],
+        "completion_tokens": stats["usage"]["completion_tokens"],
+        "usage_estimated": stats["usage_estimated"],
+        "stream_closed_early": stats["stream_closed_early"],
+    }
+    return playlist
+
+
+def get_default_experiment(num_runs=RUNS_PER_MODEL):
+    return default_experiment(MODELS, PROMPT, num_runs)
+
+
+def prepare_tasks(spec, manifest, only_keys=None):
+    """Expand the experiment matrix, drop completed runs and order the rest."""
+    tasks = expand_matrix(spec)
+    if only_keys is not None:
+        tasks = [t for t in tasks if run_key(t["cell"], t["run"]) in only_keys]
+
+    remaining = pending_tasks(manifest, tasks)
+    if len(remaining) < len(tasks):
+        print(
+            f"Resuming: {len(tasks) - len(remaining)}/{len(tasks)} runs already "
+            f"completed, scheduling {len(remaining)}"
+        )
+    return schedule_tasks(spec, remaining)
+
+
+def wait_for_rate_limit(next_start, model_spec):
+    """Reserve the model's next request slot and return how long to wait."""
+    if not model_spec["rpm"]:
+        return 0.0
+    now = time.monotonic()
+    start = max(now, next_start.get(model_spec["id"], now))
+    next_start[model_spec["id"]] = start + 60 / model_spec["rpm"]
+    return start - now
+
+
+def record_result(task, playlist, raw_response, stats, manifest, manifest_path, budget):
+    """Save or dead-letter a finished run and update manifest and budget.
+
+    Returns True if the run produced a playlist.
+    """
+    cost = budget.settle(task, stats["usage"])
+    label = f"Run {task['run']}/{task['runs']} for {task['cell']}"
+
+    if playlist:
+        run_id = get_task_run_id(task)
+        save_run(playlist, task, stats, run_id)
+        mark_run(manifest, task, COMPLETED, manifest_path, run_id=run_id, cost=cost)
+        record_run(task, stats, "completed", cost)
+        print(f"✓ {label} completed")
+        return True
+
+    print(f"✗ {label} failed")
+    record_run(task, stats, "failed", cost)
+    save_dead_letter(task, raw_response, stats)
+    mark_run(manifest, task, FAILED, manifest_path, error=stats.get("error"))
+    return False
+
+
+def generate_playlists(
+    num_runs=None, tasks=None, manifest_path=MANIFEST_FILE, spec=None, only_keys=None
+):
+    """Run the experiment sequentially, in scheduler order.
+
+    Returns the keys of the runs that completed or were dead-lettered.
+    """
+    spec = spec or get_default_experiment(num_runs or RUNS_PER_MODEL)
+    if num_runs:
+        spec["runs"] = num_runs
+    manifest = load_manifest(manifest_path, spec["name"])
+    if tasks is None:
+        tasks = prepare_tasks(spec, manifest, only_keys)
+    budget = BudgetTracker(spec)
+    next_start = {}
+
+    print(f"\n{'='*50}")
+    print(f"Experiment {spec['name']}: {len(tasks)} runs scheduled")
+    print(f"{'='*50}")
+
+    finished = set()
+    for task in tasks:
+        if not budget.reserve(task):
+            print(f"Budget exhausted, skipping run {task['run']} for {task['cell']}")
+            continue
+        try:
+            print(f"\nStarting run {task['run']}/{task['runs']} for {task['cell']}...")
+            time.sleep(
+                wait_for_rate_limit(next_start, get_model_spec(spec, task["model"]))
+            )
+            mark_run(manifest, task, IN_FLIGHT, manifest_path)
+            playlist, raw_response, stats = create_playlist(
+                task["model"], task["prompt"], task["sampling"]
+            )
+            record_result(
+                task, playlist, raw_response, stats, manifest, manifest_path, budget
+            )
+            finished.add(run_key(task["cell"], task["run"]))
+        except Exception as e:
+            print(f"✗ Error in run {task['run']} for {task['cell']}: {str(e)}")
+            mark_run(manifest, task, FAILED, manifest_path, error=str(e))
+
+    print(f"\nCompleted experiment {spec['name']}. {budget.summary()}")
+    return finished
+
+
+def percentile(values, pct):
+    """Return the nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def print_throughput_summary(latencies, completed, failed, elapsed):
+    """Print runs per second and p50/p95 request latency for a sweep."""
+    total = completed + failed
+    print(f"\n{'='*50}")
+    print("Throughput summary")
+    print(f"{'='*50}")
+    print(f"Runs: {total} ({completed} completed, {failed} failed)")
+    print(f"Wall time: {elapsed:.1f}s")
+    print(f"Throughput: {total / elapsed if elapsed > 0 else 0:.2f} runs/s")
+    print(f"Latency p50: {percentile(latencies, 50):.2f}s")
+    print(f"Latency p95: {percentile(latencies, 95):.2f}s")
+
+
+async def generate_playlists_async(
+    num_runs=None,
+    concurrency=DEFAULT_CONCURRENCY,
+    per_model_concurrency=DEFAULT_PER_MODEL_CONCURRENCY,
+    tasks=None,
+    manifest_path=MANIFEST_FILE,
+    spec=None,
+    only_keys=None,
+):
+    """Run the experiment concurrently with global and per-model caps.
+
+    Returns the keys of the runs that completed or were dead-lettered.
+    """
+    spec = spec or get_default_experiment(num_runs or RUNS_PER_MODEL)
+    if num_runs:
+        spec["runs"] = num_runs
+    manifest = load_manifest(manifest_path, spec["name"])
+    if tasks is None:
+        tasks = prepare_tasks(spec, manifest, only_keys)
+    budget = BudgetTracker(spec)
+    next_start = {}
+    global_limit = asyncio.Semaphore(concurrency)
+    model_limits = defaultdict(lambda: asyncio.Semaphore(per_model_concurrency))
+    latencies = []
+    counts = {"completed": 0, "failed": 0, "skipped": 0}
+    finished = set()
+
+    async def run_one(task):
+        # The model's slot first, so tasks queued behind a busy model do
+        # not hold global slots that other models could use
+        async with model_limits[task["model"]]:
+            if not budget.reserve(task):
+                counts["skipped"] += 1
+                return
+            await asyncio.sleep(
+                wait_for_rate_limit(next_start, get_model_spec(spec, task["model"]))
+            )
+            async with global_limit:
+                mark_run(manifest, task, IN_FLIGHT, manifest_path)
+                started = time.perf_counter()
+                playlist, raw_response, stats = await create_playlist_async(
+                    task["model"], task["prompt"], task["sampling"]
+                )
+                latencies.append(time.perf_counter() - started)
+
+        try:
+            if record_result(
+                task, playlist, raw_response, stats, manifest, manifest_path, budget
+            ):
+                counts["completed"] += 1
+            else:
+                counts["failed"] += 1
+            finished.add(run_key(task["cell"], task["run"]))
+        except Exception as e:
+            counts["failed"] += 1
+            print(f"✗ Error in run {task['run']} for {task['cell']}: {str(e)}")
+            mark_run(manifest, task, FAILED, manifest_path, error=str(e))
+
+    print(
+        f"Experiment {spec['name']}: generating {len(tasks)} playlists across "
+        f"{len({task['model'] for task in tasks})} models "
+        f"(concurrency {concurrency}, {per_model_concurrency} per model)"
+    )
+    started = time.perf_counter()
+    try:
+        # Tasks start in scheduler order because semaphores wake waiters FIFO
+        await asyncio.gather(*(run_one(task) for task in tasks))
+    finally:
+        await close_async_client()
+    elapsed = time.perf_counter() - started
+
+    print_throughput_summary(latencies, counts["completed"], counts["failed"], elapsed)
+    if counts["skipped"]:
+        print(f"Skipped {counts['skipped']} runs that did not fit the budget")
+    print(budget.summary())
+    return finished
+
+
+def _keep_lease_alive(queue_path, key, token, lease_seconds, stop):
+    """Heartbeat a claimed task from a background thread until stop is set."""
+    conn = open_queue(queue_path)
+    try:
+        while not stop.wait(lease_seconds / 3):
+            if not heartbeat(conn, key, token, lease_seconds):
+                print(f"Lease lost for {key}; another worker may re-run it")
+                break
+    finally:
+        conn.close()
+
+
+def _worker_loop(
+    spec, queue_path, worker_id, lease_seconds, latencies, counts, rate_limit
+):
+    # (next_start, lock) shared by every thread, so rpm holds per process
+    next_start, rate_lock = rate_limit
+    conn = open_queue(queue_path)
+
+    while True:
+        claimed = claim_task(
+            conn,
+            worker_id,
+            lease_seconds,
+            budget=spec["budget"],
+            estimate=lambda task: estimate_run(spec, task),
+            output_path_fn=get_task_run_id,
+        )
+        if claimed is None:
+            queue_counts = get_queue_counts(conn)
+            if queue_counts["claimed"] == 0:
+                if queue_counts["pending"]:
+                    print(f"[{worker_id}] Budget exhausted, stopping")
+                break
+            # Other workers still hold leases; wait in case one expires
+            time.sleep(WORKER_POLL_SECONDS)
+            continue
+
+        task, token, run_id = claimed
+        key = run_key(task["cell"], task["run"])
+        print(
+            f"[{worker_id}] Claimed run {task['run']}/{task['runs']} for {task['cell']}"
+        )
+
+        stop = threading.Event()
+        beat = threading.Thread(
+            target=_keep_lease_alive,
+            args=(queue_path, key, token, lease_seconds, stop),
+            daemon=True,
+        )
+        beat.start()
+        try:
+            with rate_lock:
+                delay = wait_for_rate_limit(
+                    next_start, get_model_spec(spec, task["model"])
+                )
+            time.sleep(delay)
+            started = time.perf_counter()
+            playlist, raw_response, stats = create_playlist(
+                task["model"], task["prompt"], task["sampling"]
+            )
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            playlist, raw_response = None, str(e)
+            stats = _new_stats()
+            stats["error"] = str(e)
+        finally:
+            stop.set()
+            beat.join()
+
+        usage = stats["usage"]
+        cost = get_run_cost(
+            get_model_spec(spec, task["model"]),
+            usage["prompt_tokens"],
+            usage["completion_tokens"],
+        )
+        tokens = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if playlist:
+            # The run id is fixed per task, so readers drop a duplicate run
+            save_run(playlist, task, stats, run_id)
+            record_run(task, stats, "completed", cost, worker_id)
+            if complete_task(conn, key, token, cost, tokens):
+                counts["completed"] += 1
+                print(f"[{worker_id}] ✓ Run {task['run']} for {task['cell']} completed")
+            else:
+                print(
+                    f"[{worker_id}] Run {task['run']} for {task['cell']} was re-claimed"
+                )
+        else:
+            counts["failed"] += 1
+            print(f"[{worker_id}] ✗ Run {task['run']} for {task['cell']} failed")
+            record_run(task, stats, "failed", cost, worker_id)
+            save_dead_letter(task, raw_response, stats)
+            fail_task(conn, key, token, stats.get("error"), cost, tokens)
+
+    conn.close()
+
+
+def run_worker(
+    spec,
+    queue_path=QUEUE_FILE,
+    worker_id=None,
+    lease_seconds=DEFAULT_LEASE_SECONDS,
+    threads=1,
+    requeue=False,
+):
+    """Process tasks from a queue shared with workers on other machines.
+
+    Every worker seeds the queue from the same spec (tasks already queued
+    are ignored), then claims tasks atomically until none are left.
+    Claims are kept alive by heartbeats and become claimable again when a
+    worker stops heartbeating, so runs are neither lost nor duplicated.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    conn = open_queue(queue_path)
+    added = enqueue_tasks(
+        conn,
+        schedule_tasks(spec, expand_matrix(spec)),
+        lambda task: run_key(task["cell"], task["run"]),
     )
+    if requeue:
+        print(f"Re-queued {requeue_failed(conn)} failed runs")
+    print(
+        f"Worker {worker_id}: experiment {spec['name']}, {added} new tasks queued, "
+        f"{get_queue_counts(conn)}"
+    )
+    conn.close()
 
-    with open(error_file, "w") as f:
-        f.write(f"Model: {model}\n")
-        f.write(f"Run: {run_number}\n")
-        f.write(f"Timestamp: {timestamp}\n")
-        f.write("\nRaw Response:\n")
-        f.write(str(raw_response))
+    latencies = []
+    counts = {"completed": 0, "failed": 0}
+    rate_limit = ({}, threading.Lock())
+    started = time.perf_counter()
+    workers = [
+        threading.Thread(
+            target=_worker_loop,
+            args=(
+                spec,
+                queue_path,
+                f"{worker_id}/{i}",
+                lease_seconds,
+                latencies,
+                counts,
+                rate_limit,
+            ),
+        )
+        for i in range(1, threads + 1)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
 
-    print(f"Error log saved to: {error_file}")
+    print_throughput_summary(latencies, counts["completed"], counts["failed"], elapsed)
 
 
-def generate_playlists(num_runs=10):
-    total_models = len(MODELS)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate playlists from LLMs.")
+    parser.add_argument(
+        "--experiment",
+        default=None,
+        help="JSON experiment spec (models x prompts x sampling params x runs)",
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=None,
+        help=f"Number of runs per cell (default: spec value or {RUNS_PER_MODEL})",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help="Run asynchronously with at most this many requests in flight",
+    )
+    parser.add_argument(
+        "--per-model-concurrency",
+        type=int,
+        default=DEFAULT_PER_MODEL_CONCURRENCY,
+        help="Maximum in-flight requests per model in async mode",
+    )
+    parser.add_argument(
+        "--replay-dead-letters",
+        action="store_true",
+        help="Re-run the runs in the dead-letter queue instead of a full sweep",
+    )
+    parser.add_argument(
+        "--manifest",
+        default=None,
+        help="Run manifest used to resume interrupted sweeps",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream completions and stop as soon as the JSON playlist is complete",
+    )
+    parser.add_argument(
+        "--write-run-files",
+        action="store_true",
+        help="Also write every run to outputs/<model>/playlist_run*.json",
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="Share the sweep with other machines through a queue database",
+    )
+    parser.add_argument(
+        "--queue",
+        default=None,
+        help="Queue database for --worker (must be on a filesystem all workers share)",
+    )
+    parser.add_argument(
+        "--worker-id",
+        default=None,
+        help="Name for this worker (default: hostname-pid)",
+    )
+    parser.add_argument(
+        "--lease",
+        type=int,
+        default=DEFAULT_LEASE_SECONDS,
+        help="Seconds before an unresponsive worker's task is re-queued",
+    )
+    return parser.parse_args(argv)
 
-    for model_idx, model in enumerate(MODELS, 1):
-        print(f"\n{'='*50}")
-        print(f"Processing model {model_idx}/{total_models}: {model}")
-        print(f"{'='*50}")
 
-        for run in range(1, num_runs + 1):
-            try:
-                print(f"\nStarting run {run}/{num_runs}...")
-                result = create_playlist(model)
-                playlist, raw_response = result if result else (None, None)
+def get_manifest_path(spec):
+    """Each named experiment keeps its own manifest next to the default one."""
+    if spec["name"] == DEFAULT_NAME:
+        return MANIFEST_FILE
+    return str(Path(MANIFEST_FILE).with_name(f"run_manifest_{spec['name']}.json"))
 
-                if playlist:
-                    output_path = get_output_filepath(model, run)
-                    save_playlist(playlist, output_path)
-                    print(f"✓ Run {run}/{num_runs} completed for {model}")
-                else:
-                    print(f"✗ Run {run}/{num_runs} failed for {model}")
-                    if raw_response:
-                        save_error_log(model, run, raw_response)
-            except Exception as e:
-                print(f"✗ Error in run {run}/{num_runs} for {model}: {str(e)}")
 
-        print(f"\nCompleted all runs for {model}")
+def get_queue_path(spec):
+    """Each named experiment gets its own queue, like its manifest."""
+    if spec["name"] == DEFAULT_NAME:
+        return QUEUE_FILE
+    return str(Path(QUEUE_FILE).with_name(f"work_queue_{spec['name']}.db"))
 
 
 if __name__ == "__main__":
-    generate_playlists(RUNS_PER_MODEL)
+    args = parse_args()
+    if args.experiment:
+        spec = load_experiment(args.experiment)
+    else:
+        spec = get_default_experiment()
+    if args.runs:
+        spec["runs"] = args.runs
+    manifest_path = args.manifest or get_manifest_path(spec)
+    STREAM_COMPLETIONS = args.stream
+    WRITE_RUN_FILES = args.write_run_files
+    # Import the old per-file outputs before this process appends a run
+    ensure_migrated()
+
+    if args.worker:
+        ensure_output_directory()
+        run_worker(
+            spec,
+            args.queue or get_queue_path(spec),
+            args.worker_id,
+            args.lease,
+            threads=args.concurrency or 1,
+            requeue=args.replay_dead_letters,
+        )
+    else:
+        dead_letters = (
+            read_dead_letters(spec["name"]) if args.replay_dead_letters else None
+        )
+        only_keys = (
+            {key for _, key in dead_letters} if dead_letters is not None else None
+        )
+        if args.concurrency:
+            finished = asyncio.run(
+                generate_playlists_async(
+                    concurrency=args.concurrency,
+                    per_model_concurrency=args.per_model_concurrency,
+                    manifest_path=manifest_path,
+                    spec=spec,
+                    only_keys=only_keys,
+                )
+            )
+        else:
+            finished = generate_playlists(
+                manifest_path=manifest_path, spec=spec, only_keys=only_keys
+            )
+        if dead_letters:
+            released = release_dead_letters(dead_letters, finished)
+            print(f"Removed {released} replayed runs from the dead-letter queue")
@@ -0,0 +1,88 @@
+import time
+import asyncio
+import threading
+
+
+class TokenBucket:
+    """Thread-safe, asyncio-friendly token bucket with adaptive rate.
+
+    Callers take a token before each request with acquire() (threads) or
+    acquire_async() (coroutines). A rate-limited response should be
+    reported with rate_limited(retry_after): the bucket then stops
+    handing out tokens until Retry-After has passed and halves its rate.
+    Each success reported with succeeded() raises the rate back towards
+    max_rate a step at a time, so the limiter settles just under the
+    server's quota.
+    """
+
+    def __init__(self, rate, burst=None, min_rate=None, increase=None):
+        self.max_rate = float(rate)
+        self.rate = self.max_rate
+        self.min_rate = min_rate or self.max_rate / 20
+        self.increase = increase or self.max_rate / 20
+        self.burst = burst or max(1.0, self.max_rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.rate_limited_count = 0
+        self.throttled_seconds = 0.0
+
+    def _reserve(self):
+        """Take a token, returning how long the caller must wait for it.
+
+        Tokens can go negative, so concurrent callers queue up behind each
+        other without holding the lock while they sleep.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            delay = max(0.0, -self._tokens / self.rate)
+            delay = max(delay, self._blocked_until - now)
+            self.requests += 1
+            self.throttled_seconds += delay
+            return delay
+
+    def acquire(self):
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def rate_limited(self, retry_after=None):
+        """Back off after a 429: pause for retry_after and halve the rate."""
+        with self._lock:
+            now = time.monotonic()
+            pause = retry_after if retry_after is not None else 1 / self.rate
+            self._blocked_until = max(self._blocked_until, now + pause)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+            self.rate_limited_count += 1
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def metrics(self):
+        """Current rate and how much throttling has happened so far."""
+        with self._lock:
+            return {
+                "rate": round(self.rate, 3),
+                "max_rate": self.max_rate,
+                "requests": self.requests,
+                "rate_limited": self.rate_limited_count,
+                "throttled_seconds": round(self.throttled_seconds, 3),
+                "blocked_for": round(
+                    max(0.0, self._blocked_until - time.monotonic()), 3
+                ),
+            }
@@ -0,0 +1,87 @@
+import os
+import json
+import tempfile
+from pathlib import Path
+from datetime import datetime
+from run_store import STORE_DIR, load_runs
+
+# Manifest file path
+MANIFEST_FILE = "outputs/run_manifest.json"
+
+# Run states
+IN_FLIGHT = "in_flight"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+def run_key(cell, run_number):
+    return f"{cell}#{run_number}"
+
+
+def scan_completed_runs(experiment_name="default", store_dir=STORE_DIR):
+    """Build manifest entries for an experiment's runs already in the store."""
+    runs = {}
+    for record in load_runs(store_dir, experiment_name):
+        runs[run_key(record["cell"], record["run"])] = {
+            "model": record["model"],
+            "cell": record["cell"],
+            "run": record["run"],
+            "status": COMPLETED,
+            "run_id": record["id"],
+        }
+    return runs
+
+
+def load_manifest(path=MANIFEST_FILE, experiment_name="default"):
+    """Load the run manifest, seeding it from existing outputs on first use."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"runs": scan_completed_runs(experiment_name)}
+
+
+def write_json_atomic(data, path):
+    """Write JSON through a temp file and os.replace so it is never half-written."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def save_manifest(manifest, path=MANIFEST_FILE):
+    write_json_atomic(manifest, path)
+
+
+def mark_run(manifest, task, status, manifest_path=MANIFEST_FILE, **details):
+    """Record the state of a run task and persist the manifest."""
+    entry = manifest["runs"].setdefault(
+        run_key(task["cell"], task["run"]),
+        {"model": task["model"], "cell": task["cell"], "run": task["run"]},
+    )
+    entry.update(details)
+    entry["status"] = status
+    entry["updated"] = datetime.now().strftime("%Y%m%d_%H%M%S")
+    save_manifest(manifest, manifest_path)
+
+
+def pending_tasks(manifest, tasks):
+    """Return the tasks that have not completed yet, in their original order.
+
+    In-flight entries left behind by a crashed process and failed runs are
+    both scheduled again.
+    """
+    runs = manifest["runs"]
+    return [
+        task
+        for task in tasks
+        if runs.get(run_key(task["cell"], task["run"]), {}).get("status") != COMPLETED
+    ]
@@ -0,0 +1,262 @@
+import os
+import re
+import json
+import hashlib
+import socket
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+
+# Append-only run store: one directory per experiment, one JSONL segment
+# per host inside it
+STORE_DIR = "outputs/runs"
+
+# Segment holding runs imported from the old outputs/<model>/*.json tree
+MIGRATED_SEGMENT = "migrated.jsonl"
+
+# Written in the store directory once the old tree has been imported; the
+# directory itself may already exist because a run was appended first
+MIGRATION_MARKER = ".migrated"
+
+DEFAULT_EXPERIMENT = "default"
+
+RUN_FILE_PATTERN = re.compile(r"playlist_run(\d+)_(\d{8})_(\d{6})")
+
+_write_lock = threading.Lock()
+
+# Store directories known to be migrated in this process
+_migrated = set()
+
+# Parsed segments and merged runs per store directory, see load_runs
+_ingest_cache = {}
+_cache_lock = threading.Lock()
+
+
+def append_jsonl(path, record):
+    """Append one JSON line with a single O_APPEND write.
+
+    Concurrent threads and processes appending to the same file on a
+    local filesystem never interleave their lines this way.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    line = (json.dumps(record) + "\n").encode()
+    with _write_lock:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+
+def get_segment_path(experiment, store_dir=STORE_DIR):
+    return Path(store_dir) / experiment / f"{socket.gethostname()}.jsonl"
+
+
+def append_run(record, store_dir=STORE_DIR):
+    """Add a run record to its experiment's segment for this host.
+
+    record["id"] identifies the run; if the same id is appended twice
+    (a worker re-running a task after losing its lease) readers keep the
+    last copy.
+    """
+    append_jsonl(get_segment_path(record["experiment"], store_dir), record)
+
+
+def list_segments(store_dir=STORE_DIR):
+    return sorted(Path(store_dir).glob("*/*.jsonl"))
+
+
+def _stat_segments(store_dir):
+    """(path, (inode, size, mtime_ns)) for every segment, in read order."""
+    stats = []
+    for segment in list_segments(store_dir):
+        try:
+            st = segment.stat()
+        except FileNotFoundError:
+            continue
+        stats.append((segment, (st.st_ino, st.st_size, st.st_mtime_ns)))
+    return stats
+
+
+def _fingerprint(stats):
+    digest = hashlib.sha1()
+    for segment, key in stats:
+        digest.update(f"{segment}|{key}\n".encode())
+    return digest.hexdigest()
+
+
+def ensure_migrated(store_dir=STORE_DIR):
+    """Import the old per-file outputs tree unless that was already done."""
+    key = str(Path(store_dir).resolve())
+    if key in _migrated:
+        return
+    if not (Path(store_dir) / MIGRATION_MARKER).exists():
+        migrate_outputs(store_dir=store_dir)
+    _migrated.add(key)
+
+
+def get_store_fingerprint(store_dir=STORE_DIR):
+    """Hash of every segment's path, inode, size and mtime.
+
+    It changes whenever a run is appended or a segment is replaced, so
+    callers can cache anything derived from the store against it.
+    """
+    ensure_migrated(store_dir)
+    return _fingerprint(_stat_segments(store_dir))
+
+
+def _read_segment(segment, entry):
+    """Parse the lines appended to a segment since entry["offset"].
+
+    A trailing line without its newline is still being written and is
+    left for the next read.
+    """
+    with open(segment, "rb") as f:
+        f.seek(entry["offset"])
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            # A torn line from a crashed writer
+            print(f"Skipping malformed record in {segment}")
+            continue
+        entry["records"][record["id"]] = record
+    entry["offset"] += end
+
+
+def load_runs(store_dir=STORE_DIR, experiment=None):
+    """Read every run record, parsing only what changed since the last call.
+
+    Segments are cached in memory by inode, size and mtime. Since they
+    are append-only, a segment that grew is read from where the last
+    read stopped, and an unchanged store returns the previous result
+    without touching the files. The old per-file outputs tree is
+    migrated first if it has not been yet.
+    """
+    ensure_migrated(store_dir)
+
+    with _cache_lock:
+        cache = _ingest_cache.setdefault(
+            str(Path(store_dir).resolve()),
+            {"segments": {}, "fingerprint": None, "runs": []},
+        )
+        stats = _stat_segments(store_dir)
+        fingerprint = _fingerprint(stats)
+        if fingerprint != cache["fingerprint"]:
+            segments = {}
+            for segment, key in stats:
+                entry = cache["segments"].get(segment)
+                inode, size, _ = key
+                if entry is None or entry["inode"] != inode or size < entry["offset"]:
+                    # New or rewritten segment: parse it from the start
+                    entry = {"inode": inode, "offset": 0, "records": {}}
+                if entry.get("key") != key:
+                    _read_segment(segment, entry)
+                entry["key"] = key
+                segments[segment] = entry
+
+            # Later segments win when the same run id appears twice
+            runs = {}
+            for entry in segments.values():
+                runs.update(entry["records"])
+            cache.update(
+                segments=segments, fingerprint=fingerprint, runs=list(runs.values())
+            )
+        runs = cache["runs"]
+
+    if experiment is None:
+        return list(runs)
+    return [run for run in runs if run["experiment"] == experiment]
+
+
+def make_run_record(run_id, playlist, model):
+    """Build a store record from a playlist dict as written by the generator.
+
+    Run ids look like the old relative file paths,
+    "<model dir>/playlist_run<n>_<YYYYmmdd>_<HHMMSS>[_<cell>]", and the run
+    number and timestamp are taken from them.
+    """
+    match = RUN_FILE_PATTERN.search(run_id)
+    experiment = playlist.get("experiment") or {}
+    return {
+        "id": run_id,
+        "experiment": experiment.get("name", DEFAULT_EXPERIMENT),
+        "cell": experiment.get("cell", model),
+        "model": model,
+        "prompt": experiment.get("prompt", DEFAULT_EXPERIMENT),
+        "sampling": experiment.get("sampling", DEFAULT_EXPERIMENT),
+        "params": experiment.get("params", {}),
+        "run": int(match.group(1)),
+        "timestamp": f"{match.group(2)}_{match.group(3)}",
+        "songs": playlist.get("songs", []),
+        "telemetry": playlist.get("telemetry"),
+    }
+
+
+def migrate_outputs(outputs_dir="outputs", store_dir=STORE_DIR):
+    """Import the outputs/<model>/playlist_*.json tree into the store.
+
+    Each experiment's imported runs are written to its migrated segment
+    in one atomic rename, so running the migration again just rebuilds
+    the same segments. MIGRATION_MARKER is written once it is done.
+    Returns the number of runs imported.
+    """
+    outputs_dir = Path(outputs_dir)
+    if not outputs_dir.exists():
+        return 0
+
+    segments = {}
+    for model_dir in sorted(outputs_dir.iterdir()):
+        if not model_dir.is_dir() or model_dir.name in ("error_logs", "telemetry"):
+            continue
+        if model_dir.resolve() == Path(store_dir).resolve():
+            continue
+        model_name = model_dir.name.replace("_", "/")
+        for playlist_file in sorted(model_dir.glob("playlist_*.json")):
+            match = RUN_FILE_PATTERN.match(playlist_file.name)
+            if not match:
+                continue
+            try:
+                with open(playlist_file) as f:
+                    playlist_data = json.load(f)
+            except Exception as e:
+                print(f"Error loading {playlist_file}: {e}")
+                continue
+            if "songs" not in playlist_data:
+                continue
+            record = make_run_record(
+                f"{model_dir.name}/{playlist_file.stem}", playlist_data, model_name
+            )
+            segments.setdefault(record["experiment"], []).append(record)
+
+    for experiment, records in segments.items():
+        segment_path = Path(store_dir) / experiment / MIGRATED_SEGMENT
+        segment_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=segment_path.parent, prefix=".migrating.")
+        with os.fdopen(fd, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, segment_path)
+
+    Path(store_dir).mkdir(parents=True, exist_ok=True)
+    (Path(store_dir) / MIGRATION_MARKER).touch()
+    return sum(len(records) for records in segments.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the run store.")
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help="Import outputs/<model>/playlist_*.json files into the store",
+    )
+    args = parser.parse_args()
+    if args.migrate:
+        print(f"Migrated {migrate_outputs()} runs into {STORE_DIR}/")
+    else:
+        runs = load_runs()
+        print(f"{len(runs)} runs in {len(list_segments())} segments")
@@ -1,97 +1,360 @@
 import os
-import json
+import threading
 from dotenv import load_dotenv
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-import time
+from concurrent.futures import ThreadPoolExecutor
+from metadata_cache import (
+    FOUND, NOT_FOUND, ERROR, open_cache, make_entry, is_fresh, entry_fields
+)
+from rate_limiter import TokenBucket
+import artist_store
+from canonical import canonical_artist, song_key
+from canonical import flush as canonical_flush
 
 load_dotenv()
 
-# Cache file path
-CACHE_FILE = 'spotify_cache.json'
+# Cache namespace, imported from spotify_cache.json on first use
+CACHE_NAMESPACE = 'tracks'
 
 # Load cache
 def load_cache():
-    try:
-        with open(CACHE_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
+    return open_cache(CACHE_NAMESPACE)
 
 # Save cache
 def save_cache(cache):
-    with open(CACHE_FILE, 'w') as f:
-        json.dump(cache, f, indent=2)
+    # Entries are upserted as they are set; this just commits the batch
+    cache.flush()
 
 # Initialize cache
 cache = load_cache()
 
-# Initialize Spotify client
-spotify = spotipy.Spotify(
-    client_credentials_manager=SpotifyClientCredentials(
-        client_id=os.getenv('SPOTIFY_CLIENT_ID'),
-        client_secret=os.getenv('SPOTIFY_CLIENT_SECRET')
+# Parallel track searches during bulk enrichment
+ENRICH_WORKERS = 8
+
+# Most artist IDs the Spotify artists endpoint accepts per request
+ARTISTS_BATCH_SIZE = 50
+
+# Request rate shared by every Spotify call in the process; the limiter
+# lowers it after a 429 and climbs back towards it on success
+SPOTIFY_REQUESTS_PER_SECOND = float(os.getenv('SPOTIFY_REQUESTS_PER_SECOND', 10))
+
+# Attempts per call when Spotify answers 429
+SPOTIFY_MAX_ATTEMPTS = 5
+
+# Longer Retry-After values are treated as errors instead of waited out
+SPOTIFY_MAX_RETRY_AFTER = 120
+
+rate_limiter = TokenBucket(SPOTIFY_REQUESTS_PER_SECOND)
+
+# Answer lookups from the cache only, without credentials or network
+SPOTIFY_OFFLINE = os.getenv('SPOTIFY_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+_spotify = None
+_spotify_lock = threading.Lock()
+
+def is_offline():
+    """True in offline mode or when no Spotify credentials are configured."""
+    return SPOTIFY_OFFLINE or not (
+        os.getenv('SPOTIFY_CLIENT_ID') and os.getenv('SPOTIFY_CLIENT_SECRET')
     )
-)
 
-def get_track_info(song_name, artist_name):
-    """Search for a track and return its Spotify information."""
-    search_key = f"{song_name} - {artist_name}"
-    
-    # Check cache first
-    if search_key in cache:
-        # If we have a valid Spotify URL in cache, use it
-        if cache[search_key].get('spotify_url'):
-            return cache[search_key]
-    
+def set_offline(offline=True):
+    global SPOTIFY_OFFLINE
+    SPOTIFY_OFFLINE = offline
+
+def get_spotify():
+    """Build the Spotify client on first use.
+
+    spotipy's own retries are off so that every 429 reaches spotify_call
+    with its Retry-After header.
+    """
+    global _spotify
+    if _spotify is None:
+        with _spotify_lock:
+            if _spotify is None:
+                if is_offline():
+                    raise RuntimeError(
+                        "Spotify is offline: set SPOTIFY_CLIENT_ID and "
+                        "SPOTIFY_CLIENT_SECRET and unset SPOTIFY_OFFLINE"
+                    )
+                import spotipy
+                from spotipy.oauth2 import SpotifyClientCredentials
+
+                _spotify = spotipy.Spotify(
+                    client_credentials_manager=SpotifyClientCredentials(
+                        client_id=os.getenv('SPOTIFY_CLIENT_ID'),
+                        client_secret=os.getenv('SPOTIFY_CLIENT_SECRET')
+                    ),
+                    retries=0,
+                    status_retries=0,
+                    status_forcelist=(500, 502, 503, 504)
+                )
+    return _spotify
+
+def __getattr__(name):
+    # spotify_utils.spotify still works, but only builds the client when used
+    if name == 'spotify':
+        return get_spotify()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def get_retry_after(error):
+    """Seconds from a 429's Retry-After header, or None."""
     try:
-        # Add delay to avoid rate limiting
-        time.sleep(0.1)
-        
-        # Search for the track
-        query = f"track:{song_name} artist:{artist_name}"
-        results = spotify.search(q=query, type='track', limit=1)
-        
-        if results['tracks']['items']:
-            track = results['tracks']['items'][0]
-            
-            # Get artist genres
+        return float(error.headers.get('Retry-After'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def spotify_call(method_name, *args, **kwargs):
+    """Call a Spotify client method through the shared rate limiter.
+
+    429 responses are retried after their Retry-After delay, up to
+    SPOTIFY_MAX_ATTEMPTS times.
+    """
+    from spotipy.exceptions import SpotifyException
+
+    method = getattr(get_spotify(), method_name)
+    for attempt in range(1, SPOTIFY_MAX_ATTEMPTS + 1):
+        rate_limiter.acquire()
+        try:
+            result = method(*args, **kwargs)
+        except SpotifyException as e:
+            if e.http_status != 429 or attempt == SPOTIFY_MAX_ATTEMPTS:
+                raise
+            retry_after = get_retry_after(e)
+            if retry_after is not None and retry_after > SPOTIFY_MAX_RETRY_AFTER:
+                raise
+            rate_limiter.rate_limited(retry_after)
+            continue
+        rate_limiter.succeeded()
+        return result
+
+def get_rate_limit_metrics():
+    """Current Spotify request rate and time spent throttled."""
+    return rate_limiter.metrics()
+
+def get_default_track_info():
+    """Values used for songs that could not be found or fetched."""
+    return {
+        'image_url': 'https://place-hold.it/300x300/666/fff/000.png?text=No%20Image',
+        'spotify_url': None,
+        'preview_url': None,
+        'album_name': 'Unknown Album',
+        'genres': []
+    }
+
+def search_track(song_name, artist_name):
+    """Return the best Spotify match for a song, or None."""
+    query = f"track:{song_name} artist:{artist_name}"
+    results = spotify_call('search', q=query, type='track', limit=1)
+    items = results['tracks']['items']
+    return items[0] if items else None
+
+def get_artists(artist_ids):
+    """Artists for many Spotify IDs from the artist store.
+
+    IDs not stored yet are fetched with the batch artists endpoint,
+    ARTISTS_BATCH_SIZE per request (not offline). Returns {artist_id:
+    artist}; IDs that could not be fetched are left out.
+    """
+    found = {}
+    missing = []
+    for artist_id in dict.fromkeys(artist_ids):
+        artist = artist_store.get_artist(artist_id)
+        if artist is not None:
+            found[artist_id] = artist
+        else:
+            missing.append(artist_id)
+    if is_offline():
+        return found
+
+    for i in range(0, len(missing), ARTISTS_BATCH_SIZE):
+        batch = missing[i:i + ARTISTS_BATCH_SIZE]
+        try:
+            for artist in spotify_call('artists', batch)['artists']:
+                if artist:
+                    found[artist['id']] = artist_store.save_artist(artist)
+        except Exception as e:
+            print(f"Error fetching genres for {len(batch)} artists: {e}")
+    artist_store.flush()
+    return found
+
+def get_artist_genres(artist_name):
+    """Genres of the artist a name resolves to, via the artist store.
+
+    An unknown name costs one artist search, which also stores the
+    artist, so later lookups by name or by ID need no request.
+    """
+    alias = artist_store.get_alias(artist_name)
+    offline = is_offline()
+    if alias is not None and (offline or is_fresh(alias)):
+        if alias['artist_id'] is None:
+            # A recent miss or error
+            if alias['status'] == NOT_FOUND:
+                return []
+            return artist_store.get_legacy_genres(artist_name) or []
+        artist = get_artists([alias['artist_id']]).get(alias['artist_id'])
+        if artist is not None:
+            return artist['genres']
+    if offline:
+        return artist_store.get_legacy_genres(artist_name) or []
+
+    try:
+        results = spotify_call('search', q=artist_name, type='artist', limit=1)
+        items = results['artists']['items']
+        if items:
+            artist = artist_store.save_artist(items[0])
+            artist_store.save_alias(artist_name, artist['id'])
+            return artist['genres']
+        artist_store.save_alias(artist_name, None, NOT_FOUND)
+        return []
+    except Exception as e:
+        print(f"Error getting genres for {artist_name}: {e}")
+        if alias is not None and alias['artist_id']:
+            # Keep serving the old artist rather than replacing it
+            artist = artist_store.get_artist(alias['artist_id'])
+            if artist is not None:
+                return artist['genres']
+        legacy = artist_store.get_legacy_genres(artist_name)
+        if legacy:
+            return legacy
+        # Cache the failure briefly so an outage is retried later
+        artist_store.save_alias(artist_name, None, ERROR)
+        return []
+
+def get_track_infos(pairs, max_workers=ENRICH_WORKERS):
+    """Look up Spotify information for many (song, artist) pairs at once.
+
+    Pairs are deduplicated by canonical song key, which is also the cache
+    key, and cached ones skipped. Track searches for the
+    rest run on a bounded thread pool, then the genres of every matched
+    artist are fetched with the batch artists endpoint. Offline, every
+    pair is answered from the cache, expired entries included. Returns
+    {(song, artist): info}.
+    """
+    pairs = list(dict.fromkeys(pairs))
+    keys = {pair: song_key(*pair) for pair in pairs}
+    infos = {}
+    misses = []
+    offline = is_offline()
+    queued = set()
+    for pair in pairs:
+        key = keys[pair]
+        # Several spellings of one song share a single lookup
+        if key in infos or key in queued:
+            continue
+        cached = get_cached_track(pair, key)
+        if cached and (offline or is_track_entry_fresh(cached)):
+            infos[key] = get_cached_track_info(cached)
+        elif offline:
+            infos[key] = get_default_track_info()
+        else:
+            misses.append(pair)
+            queued.add(key)
+
+    failed = set()
+
+    def search(pair):
+        try:
+            return pair, search_track(*pair)
+        except Exception as e:
+            print(f"Error fetching track info for {pair[0]} - {pair[1]}: {e}")
+            failed.add(pair)
+            return pair, None
+
+    tracks = {}
+    if misses:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for pair, track in executor.map(search, misses):
+                if track is not None:
+                    tracks[pair] = track
+
+    artists = get_artists(track['artists'][0]['id'] for track in tracks.values())
+
+    for pair in misses:
+        key = keys[pair]
+        track = tracks.get(pair)
+        if track is not None and track['artists'][0]['id'] in artists:
             artist_id = track['artists'][0]['id']
-            artist = spotify.artist(artist_id)
-            genres = artist['genres']
-            
             track_info = {
                 'image_url': track['album']['images'][0]['url'] if track['album']['images'] else None,
                 'spotify_url': track['external_urls']['spotify'],
                 'preview_url': track['preview_url'],
                 'album_name': track['album']['name'],
-                'genres': genres
+                'artist_id': artist_id,
+                'genres': artists[artist_id]['genres']
             }
             # Update cache
-            cache[search_key] = track_info
-            save_cache(cache)
-            return track_info
-    except Exception as e:
-        print(f"Error fetching track info for {song_name} - {artist_name}: {e}")
-    
-    # Default values for missing/error cases
-    default_info = {
-        'image_url': 'https://place-hold.it/300x300/666/fff/000.png?text=No%20Image',
-        'spotify_url': None,
-        'preview_url': None,
-        'album_name': 'Unknown Album',
-        'genres': []
-    }
-    
-    # Only cache if not already in cache
-    if search_key not in cache:
-        cache[search_key] = default_info
-        save_cache(cache)
-    return default_info
+            cache[key] = make_entry(FOUND, **track_info)
+            infos[key] = track_info
+            # Let genre lookups by this name reuse the matched artist
+            if (
+                canonical_artist(artists[artist_id]['name']) == canonical_artist(pair[1])
+                and artist_store.get_alias(pair[1]) is None
+            ):
+                artist_store.save_alias(pair[1], artist_id)
+            continue
+
+        # A search that raised, or a match whose genres could not be fetched
+        if pair in failed or track is not None:
+            stale = get_cached_track(pair, key)
+            if stale and stale.get('spotify_url'):
+                # Keep serving the old match rather than replacing it
+                infos[key] = get_cached_track_info(stale)
+                continue
+            status = ERROR
+        else:
+            status = NOT_FOUND
+
+        # Default values for missing/error cases
+        default_info = get_default_track_info()
+        cache[key] = make_entry(status, **default_info)
+        infos[key] = default_info
+
+    if misses:
+        cache.flush()
+        artist_store.flush()
+    canonical_flush()
+    return {pair: infos[keys[pair]] for pair in pairs}
+
+def get_cached_track(pair, key):
+    """Cache entry for a song by canonical key, or by its pre-canonical key."""
+    entry = cache.get(key)
+    if entry is None:
+        entry = cache.get(f"{pair[0]} - {pair[1]}")
+    return entry
+
+def get_cached_track_info(entry):
+    """Track info from a cache entry, with genres from the artist store."""
+    info = entry_fields(entry)
+    artist = artist_store.get_artist(info['artist_id']) if info.get('artist_id') else None
+    if artist is not None:
+        info['genres'] = artist['genres']
+    return info
+
+def is_track_entry_fresh(entry):
+    if 'status' not in entry:
+        # Entries cached before negative caching: only matches are trusted
+        return bool(entry.get('spotify_url'))
+    return is_fresh(entry)
+
+def get_track_info(song_name, artist_name):
+    """Search for a track and return its Spotify information."""
+    return get_track_infos([(song_name, artist_name)])[(song_name, artist_name)]
 
 def enrich_playlist_data(playlist_data):
     """Add Spotify information to playlist data."""
+    infos = get_track_infos((song['song'], song['artist']) for song in playlist_data)
     for song in playlist_data:
-        spotify_info = get_track_info(song['song'], song['artist'])
-        song.update(spotify_info)
+        song.update(infos[(song['song'], song['artist'])])
     return playlist_data
+
+def enrich_playlists(playlists):
+    """Enrich several {name: playlist} playlists with one bulk lookup."""
+    infos = get_track_infos(
+        (song['song'], song['artist'])
+        for playlist in playlists.values()
+        for song in playlist
+    )
+    for playlist in playlists.values():
+        for song in playlist:
+            song.update(infos[(song['song'], song['artist'])])
+    return playlists
@@ -0,0 +1,231 @@
+import json
+import time
+import uuid
+import sqlite3
+
+# Default queue location, shared by every worker pointed at the same outputs
+QUEUE_FILE = "outputs/work_queue.db"
+
+# Seconds a claim stays valid without a heartbeat
+DEFAULT_LEASE_SECONDS = 120
+
+# Task states
+PENDING = "pending"
+CLAIMED = "claimed"
+COMPLETED = "completed"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    key TEXT PRIMARY KEY,
+    priority INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_token TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    output_path TEXT,
+    reserved_cost REAL NOT NULL DEFAULT 0,
+    reserved_tokens INTEGER NOT NULL DEFAULT 0,
+    -- Spent over every attempt, completed or failed; never reset
+    cost REAL NOT NULL DEFAULT 0,
+    tokens INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_claimable ON tasks (status, priority);
+"""
+
+
+def open_queue(path=QUEUE_FILE):
+    """Open (and create if needed) the shared queue database.
+
+    The default rollback journal is used rather than WAL because WAL needs
+    shared memory and does not work across machines on a network filesystem.
+    """
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _transaction(conn, fn):
+    """Run fn(conn) inside a write-locked transaction."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = fn(conn)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return result
+
+
+def enqueue_tasks(conn, tasks, key_fn):
+    """Add tasks in priority order; tasks already in the queue are left alone.
+
+    Returns the number of tasks that were new.
+    """
+
+    def insert(conn):
+        offset = conn.execute("SELECT COALESCE(MAX(priority), -1) + 1 FROM tasks")
+        offset = offset.fetchone()[0]
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO tasks (key, priority, payload, updated) "
+            "VALUES (?, ?, ?, ?)",
+            [
+                (key_fn(task), offset + i, json.dumps(task), time.time())
+                for i, task in enumerate(tasks)
+            ],
+        )
+        return conn.total_changes - before
+
+    return _transaction(conn, insert)
+
+
+def claim_task(
+    conn,
+    worker_id,
+    lease_seconds=DEFAULT_LEASE_SECONDS,
+    budget=None,
+    estimate=None,
+    output_path_fn=None,
+):
+    """Atomically claim the next pending task or one whose lease expired.
+
+    budget is {"max_cost", "max_tokens"} shared by all workers and
+    estimate(task) returns the (cost, tokens) to reserve for a run. The
+    first claim fixes the task's output location (its run id) via
+    output_path_fn(task), so a re-run after a lost lease replaces the
+    earlier result instead of adding a duplicate.
+
+    Returns (task, lease_token, output_path) or None when nothing can be
+    claimed right now.
+    """
+
+    def claim(conn):
+        now = time.time()
+        row = conn.execute(
+            "SELECT key, payload, output_path FROM tasks "
+            "WHERE status = ? OR (status = ? AND lease_expires < ?) "
+            "ORDER BY priority LIMIT 1",
+            (PENDING, CLAIMED, now),
+        ).fetchone()
+        if row is None:
+            return None
+
+        task = json.loads(row["payload"])
+        cost, tokens = estimate(task) if estimate else (0.0, 0)
+        if budget and not _fits_budget(conn, budget, cost, tokens, row["key"], now):
+            return None
+
+        token = uuid.uuid4().hex
+        output_path = row["output_path"]
+        if output_path is None and output_path_fn is not None:
+            output_path = str(output_path_fn(task))
+        conn.execute(
+            "UPDATE tasks SET status = ?, worker = ?, lease_token = ?, "
+            "lease_expires = ?, attempts = attempts + 1, output_path = ?, "
+            "reserved_cost = ?, reserved_tokens = ?, updated = ? WHERE key = ?",
+            (
+                CLAIMED,
+                worker_id,
+                token,
+                now + lease_seconds,
+                output_path,
+                cost,
+                tokens,
+                now,
+                row["key"],
+            ),
+        )
+        return task, token, output_path
+
+    return _transaction(conn, claim)
+
+
+def _fits_budget(conn, budget, cost, tokens, key, now):
+    # Failed attempts are billed too, and their spend survives requeue_failed
+    spent = conn.execute(
+        "SELECT "
+        "COALESCE(SUM(cost), 0), "
+        "COALESCE(SUM(tokens), 0), "
+        "COALESCE(SUM(CASE WHEN status = ? AND lease_expires >= ? "
+        "AND key != ? THEN reserved_cost END), 0), "
+        "COALESCE(SUM(CASE WHEN status = ? AND lease_expires >= ? "
+        "AND key != ? THEN reserved_tokens END), 0) "
+        "FROM tasks",
+        (CLAIMED, now, key, CLAIMED, now, key),
+    ).fetchone()
+    spent_cost, spent_tokens, reserved_cost, reserved_tokens = spent
+    max_cost, max_tokens = budget.get("max_cost"), budget.get("max_tokens")
+    if max_cost is not None and spent_cost + reserved_cost + cost > max_cost:
+        return False
+    if max_tokens is not None and spent_tokens + reserved_tokens + tokens > max_tokens:
+        return False
+    return True
+
+
+def heartbeat(conn, key, token, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Extend a lease; returns False if the task is no longer ours."""
+    cursor = conn.execute(
+        "UPDATE tasks SET lease_expires = ?, updated = ? "
+        "WHERE key = ? AND lease_token = ? AND status = ?",
+        (time.time() + lease_seconds, time.time(), key, token, CLAIMED),
+    )
+    return cursor.rowcount == 1
+
+
+def complete_task(conn, key, token, cost=0.0, tokens=0):
+    """Mark a claimed task completed and add the attempt's spend.
+
+    Returns False if the lease was lost.
+    """
+    cursor = conn.execute(
+        "UPDATE tasks SET status = ?, cost = cost + ?, tokens = tokens + ?, "
+        "lease_token = NULL, "
+        "error = NULL, updated = ? WHERE key = ? AND lease_token = ?",
+        (COMPLETED, cost, tokens, time.time(), key, token),
+    )
+    return cursor.rowcount == 1
+
+
+def fail_task(conn, key, token, error, cost=0.0, tokens=0):
+    """Mark a claimed task failed and add the attempt's spend.
+
+    Returns False if the lease was lost.
+    """
+    cursor = conn.execute(
+        "UPDATE tasks SET status = ?, cost = cost + ?, tokens = tokens + ?, "
+        "lease_token = NULL, "
+        "error = ?, updated = ? WHERE key = ? AND lease_token = ?",
+        (FAILED, cost, tokens, error, time.time(), key, token),
+    )
+    return cursor.rowcount == 1
+
+
+def requeue_failed(conn):
+    """Put failed tasks back in the queue; returns how many were re-queued.
+
+    Their spend so far stays counted against the budget.
+    """
+    cursor = conn.execute(
+        "UPDATE tasks SET status = ?, updated = ? WHERE status = ?",
+        (PENDING, time.time(), FAILED),
+    )
+    return cursor.rowcount
+
+
+def get_queue_counts(conn):
+    """Return task counts by status, with expired claims counted as pending."""
+    now = time.time()
+    counts = {PENDING: 0, CLAIMED: 0, COMPLETED: 0, FAILED: 0}
+    for row in conn.execute(
+        "SELECT CASE WHEN status = ? AND lease_expires < ? THEN ? ELSE status END, "
+        "COUNT(*) FROM tasks GROUP BY 1",
+        (CLAIMED, now, PENDING),
+    ):
+        counts[row[0]] = row[1]
+    return counts